@@ -5,9 +5,8 @@ readme = open('README.md').read()
 VERSION = '0.0.1'
 
 requirements = [
-    'pandas',
+    'numpy',
     "opencv-python",
-    "fuzzywuzzy",
 ]
 
 
@@ -24,6 +23,7 @@ setup(
 
     # Package info
     packages=find_packages(exclude=('*test*',)),
+    package_data={'sharpen': ['data/*.csv']},
 
     #
     zip_safe=True,
@@ -1,8 +1,8 @@
-from .load_image_array_from_url import img_from_url
+from .load_image_array_from_url import img_from_url, imgs_from_urls
 from .process_bibitem import extract_bibitem_key
 from .time_serial_gen import generate_serial
-from .count_torch_model_parameters import count_parameters
-from .convert_torch_state_dict import enhanced_robust_map
-from .display_array_as_image import view
+from .count_torch_model_parameters import count_parameters, profile_model
+from .convert_torch_state_dict import enhanced_robust_map, stream_convert, plan_mapping, convert_many, MappingPlan
+from .display_array_as_image import view, montage
 from .push_image_dataset_to_hub import push_images
-from .dvips_color_matcher import solve as dvips_solve
+from .dvips_color_matcher import solve as dvips_solve, solve_many as dvips_solve_many
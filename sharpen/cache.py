@@ -0,0 +1,6 @@
+import os
+
+def cache_dir(*parts):
+	""" Directory for sharpen's on-disk caches: $SHARPEN_CACHE (default ~/.cache/sharpen, also if empty), joined with parts. """
+	root = os.environ.get("SHARPEN_CACHE") or os.path.join(os.path.expanduser("~"), ".cache", "sharpen")
+	return os.path.join(root, *parts)
@@ -1,8 +1,19 @@
+import sys
 import argparse
 import getpass
+import importlib
+import contextlib
+import torch
 
 from .push_image_dataset_to_hub import push_images
-from .dvips_color_matcher import solve as dvips_solve
+from .dvips_color_matcher import (
+	solve as dvips_solve, solve_many as dvips_solve_many, read_hex_file,
+	generate_latex, generate_latex_report, DEFAULT_CSV_URL
+)
+from .dvips_mix_index import MixIndex, build_index as build_dvips_index
+from .dvips_server import DvipsService, serve_stdio, serve_socket
+from .count_torch_model_parameters import profile_model, OPTIMIZER_STATES
+from .dvips_benchmark import run_benchmark, save_benchmark, load_benchmark, format_benchmark, QUICK_CASES
 
 def main():
 	parser = argparse.ArgumentParser(prog="sharpen", description="Sharpen CLI tool")
@@ -11,56 +22,170 @@ def main():
 	# Subcommand: push
 	push = subparsers.add_parser("push-images", help="Push image dataset to Hugging Face Hub")
 	push.add_argument("--images", required=True, help="Folder, tensor, or array input")
-	push.add_argument("--labels", required=True, help="Label list or .parquet path")
-	push.add_argument("--repo", required=True, help="HF dataset repo name")
+	push.add_argument("--labels", required=False, help="Label .txt (one per line) or .parquet path (required unless --infer-labels)")
+	push.add_argument("--label-column", default="label", help="Column holding the labels in a .parquet file (default: label)")
+	push.add_argument("--repo", required=False, help="HF dataset repo name (required unless --local-dir)")
 	push.add_argument("--token", required=False, help="HF token")
 	push.add_argument("--config-name", required=True, help="Dataset config/version")
-	push.add_argument("--class-names", default='', help="Class names: list, 'cifar10', or HF dataset")
+	push.add_argument("--class-names", default='', help="Class names: cifar10/cifar100/tinyimagenet, a .json/.txt file, or HF dataset")
 	push.add_argument("--private", action="store_true", help="Make dataset private")
 	push.add_argument("--image-sort-mode", default="natural", help="Sort mode: natural/plain/mtime/none")
+	push.add_argument("--streaming", action="store_true", help="Read images lazily and upload fixed-size parquet shards as they are written; reruns skip unchanged shards")
+	push.add_argument("--workers", type=int, default=None, help="Worker threads for decoding and converting images (default: serial)")
+	push.add_argument("--process-workers", action="store_true", help="Use worker processes instead of threads for --workers")
+	push.add_argument("--recursive", action="store_true", help="Also scan the image folder's subfolders")
+	push.add_argument("--infer-labels", action="store_true", help="Label each image by its class subfolder (ImageFolder layout); implies --recursive")
+	push.add_argument("--scan-cache", action="store_true", help="Cache folder listings so rescans only list changed directories")
+	push.add_argument("--passthrough", action="store_true", help="Store PNG/JPEG files from a folder with their original bytes, without re-encoding")
+	push.add_argument("--image-mode", default=None, help="Convert images to this PIL mode (e.g. RGB, L); decodes even with --passthrough")
+	push.add_argument("--image-size", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"), default=None, help="Resize images; decodes even with --passthrough")
+	push.add_argument("--local-dir", default=None, help="Write the sharded parquet dataset to this folder instead of the hub")
+	push.add_argument("--shard-size", type=int, default=1000, help="Rows per parquet shard with --streaming (default: 1000)")
 
 	# Subcommand: push
 	dvips = subparsers.add_parser("dvips", help="Approximation of a target Hex color using dvipsnames")
-	dvips.add_argument("--hex", help="Target Hex Code (e.g. #3450a0)")
+	targets = dvips.add_mutually_exclusive_group(required=True)
+	targets.add_argument("--hex", help="Target Hex Code (e.g. #3450a0)")
+	targets.add_argument("--hex-file", help="Text file of target Hex Codes, one per line")
 	dvips.add_argument("-n", "--bangs", type=int, default=2, help="Max depth of mixing (default: 2)")
 	dvips.add_argument("-m", "--metric", choices=['rgb', 'lab'], default='rgb', 
 						help="Distance metric: 'rgb' (Euclidean) or 'lab' (CIEDE2000)")
 	dvips.add_argument("--beam", type=int, default=1000, help="Beam search width (default: 1000)")
 	dvips.add_argument("--step", type=int, default=5, help="Mixing step size (default: 5)")
+	dvips.add_argument("--csv", default=None, help=f"Local path or URL of a dvipsnames CSV (default: bundled copy of {DEFAULT_CSV_URL})")
 	dvips.add_argument("--tex", action="store_true", help="Generate LaTeX report file")
 	dvips.add_argument("--output", default="color_match.tex", help="Output filename for LaTeX report")
+	dvips.add_argument("--workers", type=int, default=None, help="Worker processes: one target each with --hex-file (default: one per CPU), else beam shards (default: 1)")
+	dvips.add_argument("--refine", action="store_true", help="Treat --step as a coarse grid and refine ratios to 1%% (faster than --step 1, not always as close)")
+	dvips.add_argument("--no-dedup", dest="dedup", action="store_false", help="Let mixes with equal CMYK values occupy separate beam slots")
+	dvips.add_argument("--time-budget", type=float, default=None, help="Stop searching after this many seconds, keeping the best found")
+	dvips.add_argument("--max-evals", type=int, default=None, help="Stop searching after scoring this many mixes")
+	dvips.add_argument("--prune", action="store_true", help="Skip branches that provably cannot beat the best match so far")
+	dvips.add_argument("--progress", action="store_true", help="Print each depth's best match as soon as it is found")
+	dvips.add_argument("--index", default=None, help="Answer from a dvips-index file instead of a beam search (depth 2 is approximate: "
+							"one mix per 24-bit RGB value, up to ~1.7 RGB units worse than the best)")
+	
+	# Subcommand: dvips-index
+	dvips_index = subparsers.add_parser("dvips-index", help="Precompute a nearest-neighbour index of dvipsnames mixes (depths 0-1 exact; "
+								   "depth 2 keeps one mix per 24-bit RGB value and takes a few hundred MB at --step 5)")
+	dvips_index.add_argument("--output", required=True, help="Index file to write (.npz)")
+	dvips_index.add_argument("-n", "--bangs", type=int, choices=[1, 2], default=2, help="Max depth of mixing (default: 2)")
+	dvips_index.add_argument("--step", type=int, default=5, help="Mixing step size (default: 5)")
+	dvips_index.add_argument("--csv", default=None, help="Local path or URL of a dvipsnames CSV (default: bundled copy)")
+	
+	# Subcommand: dvips-serve
+	dvips_serve = subparsers.add_parser("dvips-serve", help="Answer JSON-lines dvips requests from a warm, long-running process")
+	dvips_serve.add_argument("--socket", default=None, help="Listen on this Unix socket path instead of stdin/stdout")
+	dvips_serve.add_argument("--port", type=int, default=None, help="Listen on this TCP port of 127.0.0.1 instead of stdin/stdout")
+	dvips_serve.add_argument("--csv", default=None, help="Local path or URL of a dvipsnames CSV (default: bundled copy)")
+	dvips_serve.add_argument("-n", "--bangs", type=int, default=2, help="Default max depth of mixing (default: 2)")
+	dvips_serve.add_argument("-m", "--metric", choices=['rgb', 'lab'], default='rgb', help="Default distance metric (default: rgb)")
+	dvips_serve.add_argument("--beam", type=int, default=1000, help="Default beam search width (default: 1000)")
+	dvips_serve.add_argument("--step", type=int, default=5, help="Default mixing step size (default: 5)")
+	dvips_serve.add_argument("--workers", type=int, default=4, help="Requests answered concurrently on stdin (default: 4)")
+	dvips_serve.add_argument("--cache-size", type=int, default=1024, help="Results kept in the LRU cache (default: 1024)")
+	
+	# Subcommand: dvips-bench
+	dvips_bench = subparsers.add_parser("dvips-bench", help="Benchmark the dvips solver on a fixed offline workload")
+	dvips_bench.add_argument("--quick", action="store_true", help="Run a reduced set of depth/beam/step cases")
+	dvips_bench.add_argument("-m", "--metric", choices=['rgb', 'lab'], action="append", default=None, help="Metric(s) to run (default: both)")
+	dvips_bench.add_argument("--repeat", type=int, default=1, help="Runs per case; the best wall time is kept (default: 1)")
+	dvips_bench.add_argument("--output", default=None, help="Save results as JSON")
+	dvips_bench.add_argument("--baseline", default=None, help="JSON results of an earlier run to compare against")
+	dvips_bench.add_argument("--prune", action="store_true", help="Benchmark with pruning enabled")
+	dvips_bench.add_argument("--refine", action="store_true", help="Benchmark with ratio refinement enabled")
+	
+	# Subcommand: profile-model
+	profile = subparsers.add_parser("profile-model", help="Parameter, buffer and training memory footprint of a torch model")
+	profile.add_argument("model", help="Model factory or instance as module:attribute (e.g. torchvision.models:resnet50)")
+	profile.add_argument("--meta", action="store_true", help="Build the model on the meta device, allocating nothing")
+	profile.add_argument("--input-shape", type=int, nargs="+", action="append", default=None,
+						 help="Shape of an example input for activation estimates (repeat for several inputs)")
+	profile.add_argument("--input-dtype", default="float32", help="dtype of the example inputs, e.g. int64 for token ids (default: float32)")
+	profile.add_argument("--optimizer", choices=list(OPTIMIZER_STATES), default="adam", help="Optimizer whose state to estimate (default: adam)")
+	profile.add_argument("--depth", type=int, default=2, help="Module tree depth to print (default: 2)")
+	profile.add_argument("--output", default=None, help="Also save the profile as JSON")
 	
 	args = parser.parse_args()
 	
 	if args.command == "push-images":
-		token = args.token or getpass.getpass("Enter Hugging Face token: ")
-		
-		# Load labels from .txt if applicable
-		labels = args.labels
-		if isinstance(labels, str) and labels.endswith(".txt"):
-			with open(labels) as f:
-				labels = [int(x.strip()) for x in f]
+		if not args.repo and not args.local_dir:
+			parser.error("push-images needs --repo or --local-dir")
+		if not args.labels and not args.infer_labels:
+			parser.error("push-images needs --labels or --infer-labels")
+		token = None if args.local_dir else args.token or getpass.getpass("Enter Hugging Face token: ")
 		
 		push_images(
 			images=args.images,
 			repo=args.repo,
 			token=token,
 			config_name=args.config_name,
-			labels=labels,
+			labels=args.labels,
+			label_column=args.label_column,
+			recursive=args.recursive,
+			infer_labels=args.infer_labels,
+			scan_cache=args.scan_cache,
 			class_names=args.class_names,
 			private=args.private,
-			image_sort_mode=args.image_sort_mode
+			image_sort_mode=args.image_sort_mode,
+			streaming=args.streaming,
+			shard_size=args.shard_size,
+			num_workers=args.workers,
+			worker_type="process" if args.process_workers else "thread",
+			passthrough=args.passthrough,
+			image_mode=args.image_mode,
+			image_size=args.image_size,
+			local_dir=args.local_dir
 		)
 	
 	
 	
 	if args.command == "dvips":
+		search_options = dict(dedup=args.dedup, refine=args.refine, time_budget=args.time_budget,
+							  max_evals=args.max_evals, prune=args.prune)
+		
+		def report(k, result):
+			print(f"  depth {k}: {result[0]:.2f} {result[2]}", file=sys.stderr, flush=True)
+	
+	if args.command == "dvips" and args.hex_file:
+		
+		hexes = read_hex_file(args.hex_file)
+		print(f"Targets: {len(hexes)} from {args.hex_file}")
+		print(f"Config: n={args.bangs}, beam={args.beam}, step={args.step}{' (refined)' if args.refine else ''}")
+		print(f"Metric: {args.metric.upper()} distance")
+		
+		if args.index:
+			index = MixIndex.load(args.index)
+			matches = [index.query(h, args.metric, args.bangs) for h in hexes]
+		else:
+			matches = dvips_solve_many(hexes, args.bangs, args.metric, args.beam, args.step, palette=args.csv, workers=args.workers, **search_options)
+		
+		print("-" * 97)
+		print(f"{'Target':<9} | {'k':<3} | {'Diff':<8} | {'Simulated RGB':<22} | {'Expression'}")
+		print("-" * 97)
+		for target, (t_rgb, res) in zip(hexes, matches):
+			for k in sorted(res.keys()):
+				gap, _, expr, rgb_val = res[k]
+				rgb_str = f"({rgb_val[0]*255:.1f}, {rgb_val[1]*255:.1f}, {rgb_val[2]*255:.1f})"
+				print(f"{target:<9} | {k:<3} | {gap:<8.2f} | {rgb_str:<22} | {expr}")
+		print("-" * 97)
+		
+		if args.tex:
+			with open(args.output, "w") as f:
+				f.write(generate_latex_report(zip(hexes, (res for _, res in matches)), args.metric.upper()))
+			print(f"LaTeX report saved to: {args.output}")
+	
+	elif args.command == "dvips":
 		
 		print(f"Target: {args.hex}")
-		print(f"Config: n={args.bangs}, beam={args.beam}, step={args.step}")
+		print(f"Config: n={args.bangs}, beam={args.beam}, step={args.step}{' (refined)' if args.refine else ''}")
 		print(f"Metric: {args.metric.upper()} distance")
 		
-		t_rgb, res = dvips_solve(args.hex, args.bangs, args.metric, args.beam, args.step)
+		if args.index:
+			t_rgb, res = MixIndex.load(args.index).query(args.hex, args.metric, args.bangs)
+		else:
+			t_rgb, res = dvips_solve(args.hex, args.bangs, args.metric, args.beam, args.step, palette=args.csv, **search_options,
+									 callback=report if args.progress else None, workers=args.workers)
 		
 		print("-" * 85)
 		print(f"{'k':<3} | {'Diff':<8} | {'Simulated RGB':<22} | {'Expression'}")
@@ -75,3 +200,41 @@ def main():
 			with open(args.output, "w") as f:
 				f.write(generate_latex(args.hex, res, args.metric.upper()))
 			print(f"LaTeX report saved to: {args.output}")
+	
+	if args.command == "dvips-index":
+		index = build_dvips_index(args.output, args.bangs, args.step, palette=args.csv)
+		print(f"Indexed {len(index):,} mixes (n<={args.bangs}, step={args.step}) into: {args.output}")
+	
+	if args.command == "dvips-serve":
+		service = DvipsService(args.csv, cache_size=args.cache_size,
+							   defaults=dict(bangs=args.bangs, metric=args.metric, beam=args.beam, step=args.step))
+		service.tables(args.step, args.metric)
+		if args.socket or args.port:
+			print(f"Serving dvips requests on {args.socket or f'127.0.0.1:{args.port}'}", file=sys.stderr, flush=True)
+			serve_socket(service, path=args.socket, port=args.port)
+		else:
+			serve_stdio(service, workers=args.workers)
+	
+	if args.command == "dvips-bench":
+		results = run_benchmark(metrics=args.metric, cases=QUICK_CASES if args.quick else None, repeat=args.repeat,
+								prune=args.prune, refine=args.refine)
+		print(format_benchmark(results, load_benchmark(args.baseline) if args.baseline else None))
+		print(f"Total: {sum(r.wall_time for r in results):.2f}s, {sum(r.evals for r in results):,} mixes scored")
+		if args.output:
+			save_benchmark(results, args.output)
+			print(f"Results saved to: {args.output}")
+	
+	if args.command == "profile-model":
+		module_name, _, attr = args.model.partition(":")
+		target = importlib.import_module(module_name)
+		for part in attr.split(".") if attr else []:
+			target = getattr(target, part)
+		with torch.device("meta") if args.meta else contextlib.nullcontext():
+			model = target if isinstance(target, torch.nn.Module) else target()
+			dtype = getattr(torch, args.input_dtype)
+			inputs = tuple(torch.zeros(shape, dtype=dtype) for shape in args.input_shape) if args.input_shape else None
+		result = profile_model(model, inputs, optimizer=args.optimizer)
+		print(result.format(max_depth=args.depth))
+		if args.output:
+			result.save(args.output)
+			print(f"Profile saved to: {args.output}")
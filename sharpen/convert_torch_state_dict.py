@@ -1,47 +1,431 @@
-from fuzzywuzzy import process
+import os
+import re
+import glob
+import json
+import hashlib
+import math
+import struct
+from functools import partial
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
 
-def enhanced_robust_map(saved_weights, model, threshold=80, order_window=2):
+from .cache import cache_dir
+
+def _key_features(keys):
+	"""
+	Rows of L2-normalised counts of each key's dot/underscore-separated
+	tokens and character trigrams, over the vocabulary of these keys.
+	"""
+	vocab = {}
+	rows, cols = [], []
+	for row, key in enumerate(keys):
+		padded = f"^{key}$"
+		grams = [f"t:{t}" for t in re.split(r"[._]", key) if t] + [padded[i:i + 3] for i in range(len(padded) - 2)]
+		for gram in grams:
+			rows.append(row)
+			cols.append(vocab.setdefault(gram, len(vocab)))
+	features = np.zeros((len(keys), max(1, len(vocab))), dtype=np.float32)
+	np.add.at(features, (rows, cols), 1.0)
+	features /= np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+	return features
+
+def _similarity(saved_keys, model_keys):
+	""" Cosine similarity of every saved key to every model key, scaled to 0..100. """
+	features = _key_features(list(saved_keys) + list(model_keys))
+	return 100.0 * features[:len(saved_keys)] @ features[len(saved_keys):].T
+
+def _linear_assignment(cost):
+	"""
+	Minimum-cost assignment of the rows of a rectangular cost matrix to
+	distinct columns (Hungarian method, shortest augmenting paths).
+	Returns (row indices, column indices), sorted by row.
+	"""
+	cost = np.asarray(cost)
+	if not np.issubdtype(cost.dtype, np.floating):
+		cost = cost.astype(np.float64)
+	transposed = cost.shape[0] > cost.shape[1]
+	if transposed:
+		cost = cost.T
+	n, m = cost.shape
+	u, v = np.zeros(n + 1), np.zeros(m + 1)
+	# match[j]: 1-based row assigned to column j (0 = free); column 0 is the root of each search
+	match = np.zeros(m + 1, dtype=np.int64)
+	way = np.zeros(m + 1, dtype=np.int64)
+	
+	for i in range(1, n + 1):
+		match[0] = i
+		j0 = 0
+		min_slack = np.full(m + 1, np.inf)
+		used = np.zeros(m + 1, dtype=bool)
+		while True:
+			used[j0] = True
+			i0 = match[j0]
+			free = ~used[1:]
+			slack = cost[i0 - 1] - u[i0] - v[1:]
+			better = free & (slack < min_slack[1:])
+			min_slack[1:][better] = slack[better]
+			way[1:][better] = j0
+			candidates = np.where(free, min_slack[1:], np.inf)
+			j1 = int(np.argmin(candidates)) + 1
+			delta = candidates[j1 - 1]
+			u[match[used]] += delta
+			v[used] -= delta
+			min_slack[1:][free] -= delta
+			j0 = j1
+			if match[j0] == 0:
+				break
+		while j0:
+			j1 = way[j0]
+			match[j0] = match[j1]
+			j0 = j1
+	
+	cols = np.nonzero(match[1:])[0]
+	rows = match[1:][cols] - 1
+	if transposed:
+		rows, cols = cols, rows
+	order = np.argsort(rows, kind="stable")
+	return rows[order], cols[order]
+
+def _match_keys(saved_shapes, model_shapes, threshold=80, order_window=2, order_weight=1.0):
+	"""
+	Map model keys to saved keys from {key: shape} dicts (in state_dict
+	order). Keys with the same name and shape pair up directly; the rest
+	are bucketed by shape and each bucket is solved as one assignment
+	problem over 100 - name similarity (counted only above threshold) plus
+	order_weight per position the two keys are apart (capped at 100), so
+	keys whose names do not clearly match pair up in order. A pair is kept
+	if it is within order_window positions or its similarity beats
+	threshold.
+	Returns {model_key: saved_key}; raises ValueError if a saved key is
+	left without a match.
+	"""
+	saved_index = {k: i for i, k in enumerate(saved_shapes)}
+	model_index = {k: i for i, k in enumerate(model_shapes)}
+	mapping = {k: k for k in saved_shapes if k in model_shapes and tuple(saved_shapes[k]) == tuple(model_shapes[k])}
+	
+	buckets = defaultdict(lambda: ([], []))
+	for k, shape in saved_shapes.items():
+		if k not in mapping:
+			buckets[tuple(shape)][0].append(k)
+	for k, shape in model_shapes.items():
+		if k not in mapping:
+			buckets[tuple(shape)][1].append(k)
+	
+	for shape, (saved_keys, model_keys) in buckets.items():
+		if not saved_keys:
+			continue
+		if not model_keys:
+			raise ValueError(f"Failed to find a robust match for saved key {saved_keys[0]}.")
+		score = _similarity(saved_keys, model_keys)
+		saved_pos = np.array([saved_index[k] for k in saved_keys])
+		model_pos = np.array([model_index[k] for k in model_keys])
+		# float32 throughout: the bucket of all biases of a large model can be thousands of keys a side
+		cost = np.abs(saved_pos[:, None] - model_pos[None, :]).astype(np.float32)
+		cost *= order_weight
+		np.minimum(cost, 100.0, out=cost)
+		cost += 100.0
+		# Names at or below threshold are a weak signal (shared tokens, trigram noise): leave those pairs to position
+		cost -= np.where(score > threshold, score, 0)
+		
+		rows, cols = _linear_assignment(cost)
+		del cost
+		assigned = dict(zip(rows.tolist(), cols.tolist()))
+		for row, saved_key in enumerate(saved_keys):
+			col = assigned.get(row)
+			if col is None or not (abs(saved_pos[row] - model_pos[col]) <= order_window or score[row, col] > threshold):
+				raise ValueError(f"Failed to find a robust match for saved key {saved_key}.")
+			mapping[model_keys[col]] = saved_key
+	
+	return {k: mapping[k] for k in model_shapes if k in mapping}
+
+def enhanced_robust_map(saved_weights, model, threshold=80, order_window=2, order_weight=1.0, cache=False):
 	"""
 	Enhanced robustly map weights using tensor shape, approximate order, and fuzzy matching.
 	
+	Keys are bucketed by shape and each bucket is matched globally (see
+	_match_keys), so the result does not depend on key order and large
+	checkpoints map in seconds.
+	
 	Parameters:
 	- saved_weights: state_dict of the saved weights.
-	- model: an instance of the PyTorch model with the desired architecture.
-	- threshold: Score threshold for fuzzy matching.
+	- model: an instance of the PyTorch model with the desired architecture, or a MappingPlan made for it.
+	- threshold: Score threshold (0-100) for name similarity.
 	- order_window: Allowable deviation in order-based matching.
+	- order_weight: Cost per position of deviation in order.
+	- cache: Reuse (and store) the mapping plan in the on-disk plan cache (see plan_mapping).
 	
 	Returns:
 	- A new state_dict with names from the model but values from saved_weights.
 	"""
 	
-	model_state = model.state_dict()
-	model_keys = list(model_state.keys())
-	saved_keys = list(saved_weights.keys())
+	if not isinstance(model, MappingPlan):
+		options = {"threshold": threshold, "order_window": order_window, "order_weight": order_weight}
+		model = _plan(state_dict_metadata(saved_weights), state_dict_metadata(model), options, cache)
+	return model.apply(saved_weights)
+
+_SAFETENSORS_DTYPES = {"F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+					   "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8, "U8": torch.uint8,
+					   "BOOL": torch.bool, "F8_E4M3": torch.float8_e4m3fn, "F8_E5M2": torch.float8_e5m2}
+_SAFETENSORS_CODES = {dtype: code for code, dtype in _SAFETENSORS_DTYPES.items()}
+
+def _read_safetensors_header(path):
+	""" {key: (dtype code, shape, absolute (start, end) byte offsets)} of a .safetensors file, read from its header only. """
+	with open(path, "rb") as f:
+		header_size = struct.unpack("<Q", f.read(8))[0]
+		header = json.loads(f.read(header_size))
+	header.pop("__metadata__", None)
+	return {k: (v["dtype"], tuple(v["shape"]), (8 + header_size + v["data_offsets"][0], 8 + header_size + v["data_offsets"][1]))
+			for k, v in header.items()}
+
+def _safetensors_files(path):
+	""" {key: file} for a .safetensors file, a .safetensors.index.json or a directory of either. """
+	if os.path.isdir(path):
+		index = sorted(glob.glob(os.path.join(path, "*.safetensors.index.json")))
+		files = index[:1] or sorted(glob.glob(os.path.join(path, "*.safetensors")))
+		if not files:
+			raise FileNotFoundError(f"No .safetensors files in {path}")
+		return {k: f for p in files for k, f in _safetensors_files(p).items()}
+	if path.endswith(".index.json"):
+		with open(path) as f:
+			weight_map = json.load(f)["weight_map"]
+		return {k: os.path.join(os.path.dirname(path), name) for k, name in weight_map.items()}
+	return {k: path for k in _read_safetensors_header(path)}
+
+class _TensorReader:
+	"""
+	Names, shapes and dtypes of a state dict without loading it, plus the
+	tensors one at a time. The source is a state dict, a module (on any
+	device, including meta), a .safetensors file, index or directory
+	(header only; tensors are read from disk on demand) or a torch
+	checkpoint (memory-mapped).
+	"""
+	def __init__(self, source):
+		self._files = self._headers = self._tensors = None
+		if isinstance(source, torch.nn.Module):
+			self._tensors = source.state_dict()
+		elif isinstance(source, dict):
+			self._tensors = source
+		elif str(source).endswith((".safetensors", ".index.json")) or os.path.isdir(source):
+			self._files = _safetensors_files(str(source))
+			headers = {f: _read_safetensors_header(f) for f in sorted(set(self._files.values()))}
+			self._headers = {k: headers[f][k] for k, f in self._files.items()}
+		else:
+			try:
+				self._tensors = torch.load(source, map_location="cpu", mmap=True, weights_only=True)
+			except RuntimeError:
+				# Legacy (non-zipfile) checkpoints cannot be memory-mapped
+				print(f"Warning: {source} cannot be memory-mapped; loading it whole")
+				self._tensors = torch.load(source, map_location="cpu", weights_only=True)
+			self._tensors = self._tensors.get("state_dict", self._tensors)
 	
-	converted_weights = {}
-	unmatched_saved_keys = []
+	def metadata(self):
+		""" {key: (shape, dtype)} in state-dict order. """
+		if self._headers is not None:
+			return {k: (shape, _SAFETENSORS_DTYPES[code]) for k, (code, shape, _) in self._headers.items()}
+		return {k: (tuple(v.shape), v.dtype) for k, v in self._tensors.items()}
 	
-	for saved_idx, saved_key in enumerate(saved_keys):
-		matched = False
-		
-		# Step 1: Shape-based and approximate order matching
-		for model_idx, model_key in enumerate(model_keys):
-			if abs(saved_idx - model_idx) <= order_window and saved_weights[saved_key].shape == model_state[model_key].shape:
-				converted_weights[model_key] = saved_weights[saved_key]
-				matched = True
-				break
-		
-		if not matched:
-			unmatched_saved_keys.append(saved_key)
+	def tensor(self, key):
+		""" The tensor under key, on the CPU. """
+		if self._headers is None:
+			return self._tensors[key].detach().cpu()
+		code, shape, (start, end) = self._headers[key]
+		with open(self._files[key], "rb") as f:
+			f.seek(start)
+			data = bytearray(end - start)
+			f.readinto(data)
+		return torch.frombuffer(data, dtype=_SAFETENSORS_DTYPES[code]).reshape(shape) if data else torch.empty(shape, dtype=_SAFETENSORS_DTYPES[code])
+
+def state_dict_metadata(source):
+	""" {key: (shape, dtype)} of a state dict, module or checkpoint path, without loading the tensors (see _TensorReader). """
+	return _TensorReader(source).metadata()
+
+def _write_safetensors(path, entries):
+	"""
+	Write entries [(key, shape, dtype, fetch)] to a .safetensors file. The
+	header is built from the metadata up front, then each fetch() is
+	called and written in turn, so only one tensor is held at a time.
+	"""
+	header, offset = {}, 0
+	for key, shape, dtype, _ in entries:
+		size = math.prod(shape) * dtype.itemsize
+		header[key] = {"dtype": _SAFETENSORS_CODES[dtype], "shape": list(shape), "data_offsets": [offset, offset + size]}
+		offset += size
+	header = json.dumps(header, separators=(",", ":")).encode()
+	header += b" " * (-len(header) % 8)
 	
-	# Step 2: Fuzzy string matching for unmatched keys
-	for saved_key in unmatched_saved_keys:
-		possible_matches = [k for k in model_keys if saved_weights[saved_key].shape == model_state[k].shape]
-		closest_match, score = process.extractOne(saved_key, possible_matches)
-		
-		if score > threshold and closest_match not in converted_weights:
-			converted_weights[closest_match] = saved_weights[saved_key]
-		else:
-			raise ValueError(f"Failed to find a robust match for saved key {saved_key}.")
+	tmp = path + ".tmp"
+	with open(tmp, "wb") as f:
+		f.write(struct.pack("<Q", len(header)))
+		f.write(header)
+		for key, shape, dtype, fetch in entries:
+			tensor = fetch().to(dtype).contiguous()
+			if tuple(tensor.shape) != tuple(shape):
+				raise ValueError(f"{key}: expected shape {tuple(shape)}, got {tuple(tensor.shape)}")
+			f.write(tensor.reshape(-1).view(torch.uint8).numpy())
+			del tensor
+	os.replace(tmp, path)
+
+def _signature(meta):
+	""" Hash of the key names and shapes (not dtypes) of {key: (shape, dtype)} metadata, in order. """
+	return hashlib.sha256(json.dumps([[k, list(shape)] for k, (shape, _) in meta.items()]).encode()).hexdigest()
+
+class MappingPlan:
+	"""
+	A computed key mapping {model key: saved key}, tied to the signatures
+	(key names and shapes) of the saved and model state dicts it was made
+	for, with the model's dtypes and the matching options. Plans round-trip
+	through JSON and can be applied to any checkpoint with the saved
+	signature in O(N), without matching again.
+	"""
+	def __init__(self, mapping, saved_signature, model_signature, model_dtypes, options):
+		self.mapping = dict(mapping)
+		self.saved_signature = saved_signature
+		self.model_signature = model_signature
+		self.model_dtypes = dict(model_dtypes)
+		self.options = dict(options)
+	
+	@property
+	def fingerprint(self):
+		return _plan_fingerprint(self.saved_signature, self.model_signature, self.options)
+	
+	def to_dict(self):
+		return {"fingerprint": self.fingerprint, "saved_signature": self.saved_signature, "model_signature": self.model_signature,
+				"options": self.options, "model_dtypes": {k: str(d).replace("torch.", "") for k, d in self.model_dtypes.items()},
+				"mapping": self.mapping}
+	
+	@classmethod
+	def from_dict(cls, d):
+		return cls(d["mapping"], d["saved_signature"], d["model_signature"],
+				   {k: getattr(torch, name) for k, name in d["model_dtypes"].items()}, d["options"])
+	
+	def save(self, path):
+		os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+		with open(path + ".tmp", "w") as f:
+			json.dump(self.to_dict(), f, indent=1)
+		os.replace(path + ".tmp", path)
+	
+	@classmethod
+	def load(cls, path):
+		with open(path) as f:
+			return cls.from_dict(json.load(f))
+	
+	def check(self, saved_meta):
+		""" Raise ValueError unless {key: (shape, dtype)} metadata has the layout this plan was made for. """
+		if _signature(saved_meta) != self.saved_signature:
+			raise ValueError("Saved weights do not have the key/shape layout this mapping plan was made for")
+	
+	def apply(self, saved_weights):
+		""" {model key: tensor} from a loaded state dict with the plan's saved layout. """
+		self.check({k: (tuple(v.shape), v.dtype) for k, v in saved_weights.items()})
+		return {model_key: saved_weights[saved_key] for model_key, saved_key in self.mapping.items()}
+	
+	def __repr__(self):
+		return f"MappingPlan({len(self.mapping)} keys, fingerprint={self.fingerprint[:12]})"
+
+# Bumped whenever _match_keys can map the same keys differently, so cached plans are not reused
+_MATCHER_VERSION = 2
+
+def _plan_fingerprint(saved_signature, model_signature, options):
+	return hashlib.sha256(json.dumps([_MATCHER_VERSION, saved_signature, model_signature, options], sort_keys=True).encode()).hexdigest()
+
+def _plan(saved_meta, model_meta, options, cache=False):
+	""" MappingPlan for the given metadata, read from or written to the on-disk plan cache if cache. """
+	saved_signature, model_signature = _signature(saved_meta), _signature(model_meta)
+	path = cache_dir("mapping-plans", _plan_fingerprint(saved_signature, model_signature, options)[:16] + ".json")
+	if cache and os.path.exists(path):
+		try:
+			return MappingPlan.load(path)
+		except (OSError, ValueError, KeyError, AttributeError):
+			pass
+	mapping = _match_keys({k: shape for k, (shape, _) in saved_meta.items()}, {k: shape for k, (shape, _) in model_meta.items()},
+						  options["threshold"], options["order_window"], options["order_weight"])
+	plan = MappingPlan(mapping, saved_signature, model_signature, {k: dtype for k, (_, dtype) in model_meta.items()}, options)
+	if cache:
+		plan.save(path)
+	return plan
+
+def plan_mapping(saved, model, threshold=80, order_window=2, order_weight=1.0, cache=True):
+	"""
+	The MappingPlan from saved to model (each a state dict, module or
+	checkpoint path; only names and shapes are read). With cache, plans
+	are kept under $SHARPEN_CACHE/mapping-plans, keyed by the fingerprint
+	of both signatures and the options, so a layout is only matched once.
+	"""
+	options = {"threshold": threshold, "order_window": order_window, "order_weight": order_weight}
+	return _plan(state_dict_metadata(saved), state_dict_metadata(model), options, cache)
+
+def stream_convert(saved, model, output_dir, max_shard_size=5 * 10**9, dtype=None, threshold=80, order_window=2, order_weight=1.0, cache=False):
+	"""
+	enhanced_robust_map() for checkpoints too big to hold twice: the key
+	mapping is computed from names and shapes only (see _TensorReader for
+	the accepted sources; the model may live on the meta device), then the
+	tensors are copied one at a time into safetensors shards of at most
+	max_shard_size bytes in the model's naming, with a
+	model.safetensors.index.json as written by transformers.
+	
+	Parameters:
+	- saved: the saved weights (state dict, module or checkpoint path).
+	- model: the target architecture (module, state dict or checkpoint path), or a MappingPlan.
+	- output_dir: directory for the shards and index.
+	- dtype: None to keep the saved dtypes, "model" to cast to the model's, or a torch.dtype.
+	- threshold, order_window, order_weight, cache: as for plan_mapping().
+	
+	Returns:
+	- The MappingPlan used.
+	"""
+	reader = _TensorReader(saved)
+	saved_meta = reader.metadata()
+	if isinstance(model, MappingPlan):
+		plan = model
+		plan.check(saved_meta)
+	else:
+		options = {"threshold": threshold, "order_window": order_window, "order_weight": order_weight}
+		plan = _plan(saved_meta, state_dict_metadata(model), options, cache)
+	
+	shards, shard_bytes = [[]], 0
+	for model_key, saved_key in plan.mapping.items():
+		shape, saved_dtype = saved_meta[saved_key]
+		out_dtype = plan.model_dtypes[model_key] if dtype == "model" else dtype or saved_dtype
+		size = math.prod(shape) * out_dtype.itemsize
+		if shards[-1] and shard_bytes + size > max_shard_size:
+			shards.append([])
+			shard_bytes = 0
+		shards[-1].append((model_key, shape, out_dtype, partial(reader.tensor, saved_key)))
+		shard_bytes += size
+	
+	os.makedirs(output_dir, exist_ok=True)
+	weight_map, total_size = {}, 0
+	for i, shard in enumerate(shards):
+		name = f"model-{i + 1:05d}-of-{len(shards):05d}.safetensors"
+		_write_safetensors(os.path.join(output_dir, name), shard)
+		for key, shape, out_dtype, _ in shard:
+			weight_map[key] = name
+			total_size += math.prod(shape) * out_dtype.itemsize
+		print(f"Wrote {os.path.join(output_dir, name)} ({len(shard)} tensors)")
+	with open(os.path.join(output_dir, "model.safetensors.index.json"), "w") as f:
+		json.dump({"metadata": {"total_size": total_size}, "weight_map": weight_map}, f, indent=2)
+	return plan
+
+def convert_many(sources, model, output_dirs, num_workers=4, **options):
+	"""
+	stream_convert() each checkpoint in sources into the matching entry of
+	output_dirs (or, given one directory, a subdirectory named after each
+	source), num_workers at a time. The mapping is planned once, from the
+	first source, and every other source must have the same layout.
+	Returns the MappingPlan.
+	"""
+	sources = list(sources)
+	if isinstance(output_dirs, str):
+		output_dirs = [os.path.join(output_dirs, os.path.splitext(os.path.basename(os.path.normpath(str(src))))[0]) for src in sources]
+	if len(output_dirs) != len(sources):
+		raise ValueError(f"Got {len(sources)} sources but {len(output_dirs)} output directories")
+	if not sources:
+		raise ValueError("No sources to convert")
 	
-	return converted_weights
+	plan_options = {k: options.pop(k) for k in ("threshold", "order_window", "order_weight", "cache") if k in options}
+	plan = model if isinstance(model, MappingPlan) else plan_mapping(sources[0], model, **plan_options)
+	with ThreadPoolExecutor(max_workers=max(1, num_workers)) as pool:
+		list(pool.map(lambda src, out: stream_convert(src, plan, out, **options), sources, output_dirs))
+	return plan
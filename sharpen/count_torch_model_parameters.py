@@ -1,8 +1,211 @@
+import json
+from collections import namedtuple, defaultdict
+import torch
+
 def count_parameters(model):
-	trainable_params = sum(p.numel() for p in model.parameters() if p.requires_grad)
-	print(f'The model has {trainable_params:,} trainable parameters')
+	trainable_params = total_params = 0
+	for p in model.parameters():
+		total_params += p.numel()
+		if p.requires_grad:
+			trainable_params += p.numel()
 	
-	total_params = sum(p.numel() for p in model.parameters())
+	print(f'The model has {trainable_params:,} trainable parameters')
 	print(f'The model has {total_params:,} total parameters')
 	
 	return total_params, trainable_params
+
+# State tensors an optimizer keeps per trainable parameter, each the size of the parameter
+OPTIMIZER_STATES = {"sgd": 0, "momentum": 1, "adagrad": 1, "rmsprop": 1, "adam": 2, "adamw": 2}
+
+ModuleFootprint = namedtuple("ModuleFootprint", ["name", "type", "depth", "params", "trainable", "buffers",
+												 "param_bytes", "buffer_bytes", "activation_bytes"])
+
+def _nbytes(t):
+	return t.numel() * t.element_size()
+
+def _output_bytes(output):
+	""" Bytes of all tensors in a module output (tensors, or tuples, lists and dicts of them). """
+	if isinstance(output, torch.Tensor):
+		return _nbytes(output)
+	if isinstance(output, (tuple, list)):
+		return sum(_output_bytes(o) for o in output)
+	if isinstance(output, dict):
+		return sum(_output_bytes(o) for o in output.values())
+	return 0
+
+def _to_meta(x):
+	if isinstance(x, torch.Tensor):
+		return x.to("meta")
+	if isinstance(x, (tuple, list)):
+		return type(x)(_to_meta(v) for v in x)
+	if isinstance(x, dict):
+		return {k: _to_meta(v) for k, v in x.items()}
+	return x
+
+def _fmt_bytes(n):
+	return f"{n / 2**20:,.1f} MB"
+
+class ModelProfile:
+	"""
+	Footprint of a model: one ModuleFootprint per module (totals include
+	submodules; a tensor shared between modules is counted once, under the
+	first module that holds it), parameter and buffer bytes by dtype and
+	by device, groups of names bound to the same tensor (tied weights), and
+	estimated training memory: gradients, optimizer state and, if the
+	model was run on example inputs, activations (the outputs of its leaf
+	modules).
+	"""
+	def __init__(self, modules, by_dtype, by_device, shared, trainable_bytes, optimizer, activation_bytes):
+		self.modules = modules
+		self.by_dtype = by_dtype
+		self.by_device = by_device
+		self.shared = shared
+		self.trainable_bytes = trainable_bytes
+		self.optimizer = optimizer
+		self.activation_bytes = activation_bytes
+	
+	@property
+	def params(self):
+		return self.modules[0].params
+	
+	@property
+	def trainable(self):
+		return self.modules[0].trainable
+	
+	@property
+	def param_bytes(self):
+		return self.modules[0].param_bytes
+	
+	@property
+	def buffer_bytes(self):
+		return self.modules[0].buffer_bytes
+	
+	@property
+	def grad_bytes(self):
+		return self.trainable_bytes
+	
+	@property
+	def optimizer_bytes(self):
+		return OPTIMIZER_STATES[self.optimizer] * self.trainable_bytes
+	
+	@property
+	def training_bytes(self):
+		""" Parameters, buffers, gradients, optimizer state and activations. """
+		return self.param_bytes + self.buffer_bytes + self.grad_bytes + self.optimizer_bytes + (self.activation_bytes or 0)
+	
+	def to_dict(self):
+		return {"params": self.params, "trainable": self.trainable, "param_bytes": self.param_bytes, "buffer_bytes": self.buffer_bytes,
+				"grad_bytes": self.grad_bytes, "optimizer": self.optimizer, "optimizer_bytes": self.optimizer_bytes,
+				"activation_bytes": self.activation_bytes, "training_bytes": self.training_bytes,
+				"by_dtype": self.by_dtype, "by_device": self.by_device, "shared": self.shared,
+				"modules": [m._asdict() for m in self.modules]}
+	
+	def format(self, max_depth=None):
+		""" Module tree (down to max_depth) followed by the totals. """
+		header = f"{'Module':<40} | {'Type':<20} | {'Params':>13} | {'Param MB':>9} | {'Buffer MB':>9} | {'Act MB':>8}"
+		lines = [header, "-" * len(header)]
+		for m in self.modules:
+			if max_depth is not None and m.depth > max_depth:
+				continue
+			name = "  " * m.depth + (m.name.rsplit(".", 1)[-1] if m.name else "(model)")
+			act = f"{m.activation_bytes / 2**20:>8.1f}" if m.activation_bytes is not None else f"{'-':>8}"
+			lines.append(f"{name[:40]:<40} | {m.type[:20]:<20} | {m.params:>13,} | {m.param_bytes / 2**20:>9.1f} | "
+						 f"{m.buffer_bytes / 2**20:>9.1f} | {act}")
+		lines.append("")
+		lines.append(f"Parameters: {self.params:,} ({self.trainable:,} trainable)")
+		lines.append("By dtype: " + ", ".join(f"{k} {_fmt_bytes(v)}" for k, v in self.by_dtype.items()))
+		lines.append("By device: " + ", ".join(f"{k} {_fmt_bytes(v)}" for k, v in self.by_device.items()))
+		for names in self.shared:
+			lines.append("Tied: " + " = ".join(names))
+		activations = _fmt_bytes(self.activation_bytes) if self.activation_bytes is not None else "not measured"
+		lines.append(f"Training estimate: params {_fmt_bytes(self.param_bytes)} + buffers {_fmt_bytes(self.buffer_bytes)} + "
+					 f"grads {_fmt_bytes(self.grad_bytes)} + {self.optimizer} state {_fmt_bytes(self.optimizer_bytes)} + "
+					 f"activations {activations} = {_fmt_bytes(self.training_bytes)}")
+		return "\n".join(lines)
+	
+	def __str__(self):
+		return self.format()
+	
+	def save(self, path):
+		with open(path, "w") as f:
+			json.dump(self.to_dict(), f, indent=1)
+
+def profile_model(model, inputs=None, optimizer="adam"):
+	"""
+	ModelProfile of model. Only tensor metadata is read, so the model may
+	live on the meta device. With inputs (a tensor, a tuple of positional
+	inputs or a dict of keyword inputs), one forward pass is run under
+	no_grad with hooks recording each module's output size; for a meta
+	model, tensor inputs are moved to meta, so nothing is allocated.
+	"""
+	if optimizer not in OPTIMIZER_STATES:
+		raise ValueError(f"Unknown optimizer: {optimizer} (expected one of {', '.join(OPTIMIZER_STATES)})")
+	
+	# Tied weights: every name bound to each parameter or buffer object
+	names = defaultdict(list)
+	for name, t in list(model.named_parameters(remove_duplicate=False)) + list(model.named_buffers(remove_duplicate=False)):
+		names[id(t)].append(name)
+	shared = [group for group in names.values() if len(group) > 1]
+	
+	modules = list(model.named_modules())
+	own = {name: [0, 0, 0, 0, 0] for name, _ in modules}  # params, trainable, buffers, param_bytes, buffer_bytes
+	by_dtype, by_device = defaultdict(int), defaultdict(int)
+	seen, trainable_bytes = set(), 0
+	for name, module in modules:
+		for kind, tensors in ((0, module._parameters), (1, module._buffers)):
+			for t in tensors.values():
+				if t is None or id(t) in seen:
+					continue
+				seen.add(id(t))
+				size = _nbytes(t)
+				stats = own[name]
+				if kind == 0:
+					stats[0] += t.numel()
+					stats[3] += size
+					if t.requires_grad:
+						stats[1] += t.numel()
+						trainable_bytes += size
+				else:
+					stats[2] += t.numel()
+					stats[4] += size
+				by_dtype[str(t.dtype).replace("torch.", "")] += size
+				by_device[str(t.device)] += size
+	
+	totals = {name: [0, 0, 0, 0, 0] for name, _ in modules}
+	for name, stats in own.items():
+		parts = name.split(".") if name else []
+		for i in range(len(parts) + 1):
+			prefix = ".".join(parts[:i])
+			if prefix in totals:
+				totals[prefix] = [a + b for a, b in zip(totals[prefix], stats)]
+	
+	activations = None
+	if inputs is not None:
+		activations = defaultdict(int)
+		
+		def record(name):
+			def hook(module, args, output):
+				activations[name] += _output_bytes(output)
+			return hook
+		
+		handles = [module.register_forward_hook(record(name)) for name, module in modules]
+		first = next(iter(model.parameters()), None)
+		if first is not None and first.device.type == "meta":
+			inputs = _to_meta(inputs)
+		try:
+			with torch.no_grad():
+				if isinstance(inputs, dict):
+					model(**inputs)
+				else:
+					model(*inputs) if isinstance(inputs, tuple) else model(inputs)
+		finally:
+			for handle in handles:
+				handle.remove()
+	
+	footprints = [ModuleFootprint(name, type(module).__name__, name.count(".") + 1 if name else 0, *totals[name],
+								  activations.get(name, 0) if activations is not None else None)
+				  for name, module in modules]
+	activation_bytes = None
+	if activations is not None:
+		activation_bytes = sum(activations.get(name, 0) for name, module in modules if not any(True for _ in module.children()))
+	return ModelProfile(footprints, dict(by_dtype), dict(by_device), shared, trainable_bytes, optimizer, activation_bytes)
@@ -1,50 +1,243 @@
+import math
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
 import numpy as np
 import torch
+from PIL import Image as PILImage
 
-def view(images, max_images=5, normalise=False, bounding_boxes=None, axis = True):
+def _channel_last(images):
+	""" Move the (first) axis of size < 4 after the batch axis to the end. """
+	dim_to_move_last = np.where(np.array(images.shape[1:]) < 4)[0][0] + 1
+	return np.transpose(images, (0, *range(1, dim_to_move_last), *range(dim_to_move_last + 1, 4), dim_to_move_last))
+
+def _to_uint8_rgb(images, normalise=False):
+	"""
+	NHWC images (C = 1 or 3) as uint8 RGB the way imshow would show them:
+	single-channel images are min-max scaled per image, as are colour images
+	with normalise; otherwise floats are clipped to [0, 1] and integers to
+	[0, 255]. Vectorized over the batch.
+	"""
+	gray = images.shape[-1] == 1
+	if gray or normalise:
+		flat = images.reshape(len(images), -1)
+		lo = flat.min(axis=1).astype(np.float64)[:, None, None, None]
+		hi = flat.max(axis=1).astype(np.float64)[:, None, None, None]
+		scaled = (images - lo) / np.where(hi > lo, hi - lo, 1.0)
+	elif np.issubdtype(images.dtype, np.floating):
+		scaled = np.clip(images, 0.0, 1.0)
+	else:
+		scaled = np.clip(images, 0, 255) / 255.0
+	out = (scaled * 255.0 + 0.5).astype(np.uint8)
+	return np.repeat(out, 3, axis=-1) if gray else out
+
+def _to_uint8_rgb_torch(images, normalise=False):
+	""" _to_uint8_rgb() for a torch tensor, computed on the tensor's device. """
+	gray = images.shape[-1] == 1
+	x = images.float()
+	if gray or normalise:
+		flat = x.reshape(len(x), -1)
+		lo = flat.amin(dim=1).view(-1, 1, 1, 1)
+		hi = flat.amax(dim=1).view(-1, 1, 1, 1)
+		scaled = (x - lo) / torch.where(hi > lo, hi - lo, torch.ones_like(hi))
+	elif images.is_floating_point():
+		scaled = x.clamp(0.0, 1.0)
+	else:
+		scaled = x.clamp(0, 255) / 255.0
+	out = (scaled * 255.0 + 0.5).to(torch.uint8)
+	return out.repeat(1, 1, 1, 3) if gray else out
+
+def _prepare(images, bounding_boxes=None, limit=None, max_size=None, to_uint8=False, normalise=False):
+	"""
+	Bring one batch into displayable form where it lives: add missing batch
+	and channel axes, slice to limit, move channels last, subsample by an
+	integer factor so neither side exceeds max_size (boxes are scaled to
+	match) and, with to_uint8, convert as _to_uint8_rgb(). Only the result
+	is copied to host memory. Returns (NHWC np.ndarray, np.ndarray of boxes
+	or None).
+	"""
+	is_torch = isinstance(images, torch.Tensor)
+	if not is_torch and not isinstance(images, np.ndarray):
+		raise TypeError(f"Expected images as a torch.Tensor or np.ndarray, got {type(images).__name__}")
+	
+	if images.ndim == 2:
+		images = images[None, None]
+	if images.ndim == 3:
+		images = images[None]
+	elif images.ndim != 4:
+		raise ValueError(f"Expected images with 2 to 4 dimensions, got shape {tuple(images.shape)}")
+	
+	if bounding_boxes is not None:
+		if not isinstance(bounding_boxes, (torch.Tensor, np.ndarray)):
+			raise TypeError(f"Expected bounding boxes as a torch.Tensor or np.ndarray, got {type(bounding_boxes).__name__}")
+		if bounding_boxes.ndim == 2:
+			bounding_boxes = bounding_boxes[None]
+		elif bounding_boxes.ndim != 3:
+			raise ValueError(f"Expected bounding boxes of shape (N, 4) or (B, N, 4), got {tuple(bounding_boxes.shape)}")
+		if len(bounding_boxes) != len(images):
+			raise ValueError(f"Got bounding boxes for {len(bounding_boxes)} images but {len(images)} images")
+		bounding_boxes = bounding_boxes[:limit]
+	
+	images = images[:limit]
+	dim_to_move_last = int(np.where(np.array(images.shape[1:]) < 4)[0][0]) + 1
+	order = (0, *range(1, dim_to_move_last), *range(dim_to_move_last + 1, 4), dim_to_move_last)
+	images = images.permute(order) if is_torch else np.transpose(images, order)
+	
+	if max_size and max(images.shape[1:3]) > max_size:
+		factor = math.ceil(max(images.shape[1:3]) / max_size)
+		images = images[:, ::factor, ::factor]
+		if bounding_boxes is not None:
+			bounding_boxes = bounding_boxes / factor
+	
+	if to_uint8:
+		images = _to_uint8_rgb_torch(images, normalise) if is_torch else _to_uint8_rgb(images, normalise)
+	if is_torch:
+		images = images.cpu().numpy()
+	if isinstance(bounding_boxes, torch.Tensor):
+		bounding_boxes = bounding_boxes.cpu().numpy()
+	return images, bounding_boxes
+
+def _is_boxes(x):
+	""" Whether x has the shape of bounding boxes: (N, 4) or (B, N, 4). """
+	return isinstance(x, (torch.Tensor, np.ndarray)) and x.ndim in (2, 3) and x.shape[-1] == 4
+
+def _split_batch(batch):
+	"""
+	(images, boxes or None) of one batch: an array or tensor, or a tuple or
+	list such as a DataLoader's [images, labels], whose first element is
+	the images and whose second is taken as boxes only if shaped like them.
+	"""
+	if not isinstance(batch, (tuple, list)):
+		return batch, None
+	if not batch:
+		raise ValueError("Got an empty batch")
+	return batch[0], batch[1] if len(batch) > 1 and _is_boxes(batch[1]) else None
+
+def _take(batches, limit=None, **options):
+	"""
+	Pull batches (arrays or tensors, or (images, boxes) pairs) from an
+	iterable until limit images are collected, preparing each with
+	_prepare(). Returns (NHWC np.ndarray, list of per-image boxes or None).
+	"""
+	images, boxes = [], []
+	for batch in batches:
+		batch_images, batch_boxes = _split_batch(batch)
+		remaining = None if limit is None else limit - sum(len(b) for b in images)
+		batch_images, batch_boxes = _prepare(batch_images, batch_boxes, remaining, **options)
+		images.append(batch_images)
+		boxes.extend(batch_boxes if batch_boxes is not None else [None] * len(batch_images))
+		if limit is not None and sum(len(b) for b in images) >= limit:
+			break
+	if not images:
+		raise ValueError("No images to view")
+	if all(b is None for b in boxes):
+		boxes = None
+	else:
+		boxes = [np.zeros((0, 4)) if b is None else b for b in boxes]
+	return np.concatenate(images), boxes
+
+def _spans(starts, lengths):
+	""" Concatenated ranges starts[i] .. starts[i] + lengths[i] - 1. """
+	return np.repeat(starts, lengths) + np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+def _draw_boxes(canvas, boxes, origins, color, width):
+	"""
+	Rasterize (x1, y1, x2, y2) boxes onto canvas in place, all at once. Each
+	box is relative to, and clipped to, its tile (top, left, bottom, right).
+	"""
+	keep = np.isfinite(boxes).all(axis=1)
+	boxes, (top, left, bottom, right) = boxes[keep], origins[keep].T
+	xs = np.clip(np.round(boxes[:, [0, 2]]).astype(int) + left[:, None], left[:, None], right[:, None] - 1)
+	ys = np.clip(np.round(boxes[:, [1, 3]]).astype(int) + top[:, None], top[:, None], bottom[:, None] - 1)
+	x1, x2 = xs.min(axis=1), xs.max(axis=1)
+	y1, y2 = ys.min(axis=1), ys.max(axis=1)
+	w, h = x2 - x1 + 1, y2 - y1 + 1
+	for k in range(width):
+		for y in (np.minimum(y1 + k, y2), np.maximum(y2 - k, y1)):
+			canvas[np.repeat(y, w), _spans(x1, w)] = color
+		for x in (np.minimum(x1 + k, x2), np.maximum(x2 - k, x1)):
+			canvas[_spans(y1, h), np.repeat(x, h)] = color
+
+def montage(images, ncols=None, normalise=False, bounding_boxes=None, pad=1, box_color=(255, 0, 0), box_width=1):
+	"""
+	Tile a batch of images into a single uint8 RGB canvas.
+	
+	Args:
+		images (np.ndarray): N images, channel-last or channel-first, as accepted by view().
+		ncols (int): Tiles per row (default: a roughly square grid).
+		normalise (bool): Min-max scale each colour image (grayscale images always are).
+		bounding_boxes (np.ndarray or list): Per image, an array of (x1, y1, x2, y2) boxes, drawn onto the canvas.
+		pad (int): Pixels of black between tiles.
+	
+	Returns:
+		np.ndarray: The (H, W, 3) uint8 canvas.
+	"""
+	return _tile(_to_uint8_rgb(_channel_last(images), normalise), ncols, bounding_boxes, pad, box_color, box_width)
+
+def _tile(images, ncols=None, bounding_boxes=None, pad=1, box_color=(255, 0, 0), box_width=1):
+	""" montage() of images that are already NHWC uint8 RGB. """
+	n, h, w, _ = images.shape
+	ncols = ncols or max(1, math.ceil(math.sqrt(n)))
+	nrows = max(1, math.ceil(n / ncols))
+	
+	tiles = np.zeros((nrows * ncols, h + pad, w + pad, 3), dtype=np.uint8)
+	tiles[:n, pad:, pad:] = images
+	canvas = tiles.reshape(nrows, ncols, h + pad, w + pad, 3).transpose(0, 2, 1, 3, 4).reshape(nrows * (h + pad), ncols * (w + pad), 3)
+	canvas = np.pad(canvas, ((0, pad), (0, pad), (0, 0)))
+	
+	if bounding_boxes is not None:
+		counts = [len(b) for b in bounding_boxes[:n]]
+		if sum(counts):
+			boxes = np.concatenate([np.asarray(b, dtype=np.float64).reshape(-1, 4) for b in bounding_boxes[:n]])
+			idx = np.repeat(np.arange(len(counts)), counts)
+			top, left = (idx // ncols) * (h + pad) + pad, (idx % ncols) * (w + pad) + pad
+			origins = np.stack([top, left, top + h, left + w], axis=1)
+			_draw_boxes(canvas, boxes, origins, np.array(box_color, dtype=np.uint8), box_width)
+	return canvas
+
+def view(images, max_images=5, normalise=False, bounding_boxes=None, axis = True, grid=False, ncols=None, save=None, max_size=None):
 	"""
 	Display images with optional bounding boxes.
 	
+	Slicing to max_images, moving channels last, downsampling and (for the
+	montage) uint8 conversion happen on the images' own device, so only the
+	displayed pixels are copied to host memory.
+	
 	Args:
-		images (torch.Tensor or np.ndarray): The input images as a tensor or NumPy array.
-		max_images (int): The maximum number of images to display.
+		images (torch.Tensor or np.ndarray or iterable): The input images as a tensor or NumPy array, or an
+			iterable of such batches, read only until max_images are collected. A batch may also be a tuple or list
+			such as a DataLoader's [images, labels]: its first element is the images, and its second is drawn as
+			bounding boxes if shaped (N, 4) or (B, N, 4).
+		max_images (int): The maximum number of images to display (None for all).
 		normalise (bool): Whether to normalize the image intensity.
 		bounding_boxes (list of list of numpy.ndarray): A list of lists of bounding boxes, where each inner list
 			contains bounding boxes for a single image. Each bounding box is a NumPy array with shape (4,)
 			representing (x1, y1, x2, y2).
+		grid (bool): Tile the images into one montage canvas (see montage()) shown with a single imshow.
+		ncols (int): Tiles per row of the montage.
+		save (str): Write the montage to this PNG path instead of showing it (no display needed).
+		max_size (int): Subsample images larger than this (in either side) by an integer factor before display.
 	
 	Returns:
-		None
+		The displayed images, or the montage canvas with grid or save.
 	"""
-	if isinstance(images, torch.Tensor):
-		images = images.cpu().numpy()
-	else:
-		assert isinstance(images, np.ndarray)
-	
-	if images.ndim == 2:
-		images = images[np.newaxis, np.newaxis, :]
-	if images.ndim == 3:
-		images = images[np.newaxis, :]
+	options = dict(max_size=max_size, to_uint8=bool(grid or save), normalise=normalise)
+	if isinstance(images, (torch.Tensor, np.ndarray)):
+		images, bounding_boxes = _prepare(images, bounding_boxes, max_images, **options)
 	else:
-		assert images.ndim == 4
+		if bounding_boxes is not None:
+			raise ValueError("Pass boxes with lazy inputs as (images, bounding_boxes) pairs")
+		images, bounding_boxes = _take(images, max_images, **options)
 	
-	if bounding_boxes is not None:
-		if isinstance(bounding_boxes, torch.Tensor):
-			bounding_boxes = bounding_boxes.cpu().numpy()
-		else:
-			assert isinstance(bounding_boxes, np.ndarray)
-		if bounding_boxes.ndim == 2:
-			bounding_boxes = bounding_boxes[np.newaxis, :]
+	if grid or save:
+		canvas = _tile(images, ncols=ncols, bounding_boxes=bounding_boxes)
+		if save:
+			PILImage.fromarray(canvas).save(save)
 		else:
-			assert (bounding_boxes.ndim == 3)
-		assert (len(bounding_boxes) == len(images))
-	
-	images = images[:max_images]
-	
-	dim_to_move_last = np.where(np.array(images.shape[1:]) < 4)[0][0] + 1
-	images = np.transpose(images, (0, *range(1, dim_to_move_last), *range(dim_to_move_last + 1, 4), dim_to_move_last))
+			plt.imshow(canvas)
+			if not axis:
+				plt.axis('off')
+			plt.show()
+		return canvas
 	
 	for idx, img in enumerate(images):
 		norm = mcolors.Normalize(vmin=img.min(), vmax=img.max()) if normalise else None
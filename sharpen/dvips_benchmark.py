@@ -0,0 +1,68 @@
+import json
+import time
+import tracemalloc
+from collections import namedtuple
+
+from .dvips_color_matcher import solve, _tables_for
+
+# Fixed, offline workload: hues across the gamut plus a grey and a near-white
+BENCH_TARGETS = ["#3450A0", "#FFBE7A", "#12AB34", "#E0115F", "#7F7F7F", "#F5F0E1"]
+BENCH_METRICS = ["rgb", "lab"]
+# (max_bangs, beam_width, step_size)
+BENCH_CASES = [(1, 1000, 5), (2, 1000, 5), (2, 1000, 1), (3, 1000, 5), (3, 5000, 5)]
+QUICK_CASES = [(1, 1000, 5), (2, 1000, 5), (3, 500, 10)]
+
+BenchResult = namedtuple("BenchResult", ["target", "metric", "bangs", "beam", "step",
+										 "wall_time", "evals", "evals_per_s", "peak_mb", "gap"])
+
+def run_benchmark(targets=None, metrics=None, cases=None, repeat=1, palette=None, **options):
+	"""
+	Time solve() over targets x metrics x (max_bangs, beam_width, step_size)
+	cases against the bundled palette (or the given one). Mix tables are
+	built before timing. Each run reports the best wall time of `repeat`,
+	mixes scored per second, peak traced memory of one run and the gap of
+	the deepest result. Extra keyword options are passed to solve().
+	"""
+	results = []
+	for bangs, beam, step in cases or BENCH_CASES:
+		tables = _tables_for(palette, step)
+		for metric in metrics or BENCH_METRICS:
+			tables.coords(metric)
+			for target in targets or BENCH_TARGETS:
+				wall_time = float("inf")
+				for i in range(repeat):
+					if i == 0:
+						tracemalloc.start()
+					start = time.perf_counter()
+					_, res, stats = solve(target, bangs, metric, beam, step, palette=tables, return_stats=True, **options)
+					wall_time = min(wall_time, time.perf_counter() - start)
+					if i == 0:
+						peak = tracemalloc.get_traced_memory()[1]
+						tracemalloc.stop()
+				results.append(BenchResult(target, metric, bangs, beam, step, wall_time, stats.evals,
+										   stats.evals / wall_time, peak / 2**20, float(res[max(res)][0])))
+	return results
+
+def save_benchmark(results, path):
+	with open(path, "w") as f:
+		json.dump([r._asdict() for r in results], f, indent=1)
+
+def load_benchmark(path):
+	with open(path) as f:
+		return [BenchResult(**r) for r in json.load(f)]
+
+def format_benchmark(results, baseline=None):
+	""" Table of results; with a baseline run, adds the wall-time ratio and gap change per matching case. """
+	base = {r[:5]: r for r in baseline or []}
+	header = f"{'Target':<9} | {'Metric':<6} | {'n':<2} | {'Beam':>5} | {'Step':>4} | {'Wall s':>8} | {'Evals/s':>11} | {'Peak MB':>8} | {'Gap':>8}"
+	if baseline is not None:
+		header += f" | {'x Base':>7} | {'Gap diff':>9}"
+	lines = [header, "-" * len(header)]
+	for r in results:
+		line = (f"{r.target:<9} | {r.metric:<6} | {r.bangs:<2} | {r.beam:>5} | {r.step:>4} | {r.wall_time:>8.3f} | "
+				f"{r.evals_per_s:>11,.0f} | {r.peak_mb:>8.1f} | {r.gap:>8.4f}")
+		if baseline is not None:
+			b = base.get(r[:5])
+			line += f" | {r.wall_time / b.wall_time:>7.2f} | {r.gap - b.gap:>+9.4f}" if b else f" | {'-':>7} | {'-':>9}"
+		lines.append(line)
+	return "\n".join(lines)
@@ -9,16 +9,37 @@ standard LaTeX colors (dvipsnames) and the xcolor '!' mixing syntax.
 Information Source:
     Color definitions based on: https://en.wikibooks.org/wiki/LaTeX/Colors
     Default Data Source: https://github.com/cestwc/sharpen/releases/download/v1.0.0/dvipsnames.csv
+                         (bundled as sharpen/data/dvipsnames.csv, used offline by default)
 """
 
+import io
+import os
+import sys
+import csv
 import math
-import heapq
-import pandas as pd
+import time
+import hashlib
+import pkgutil
+import urllib.request
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+try:
+	from .cache import cache_dir
+except ImportError:
+	# Run as a script (python sharpen/dvips_color_matcher.py): import from the package it sits in
+	sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+	from sharpen.cache import cache_dir
 
 # -------------------------------------------------------------------------
 # CONSTANTS
 # -------------------------------------------------------------------------
 DEFAULT_CSV_URL = "https://github.com/cestwc/sharpen/releases/download/v1.0.0/dvipsnames.csv"
+BUNDLED_CSV = "data/dvipsnames.csv"  # offline copy of DEFAULT_CSV_URL, inside the package
+EVAL_CHUNK_SIZE = 1 << 18  # mixes scored per vectorized kernel call
+REFINE_POOL = 16  # with refine, coarse mixes refined per beam slot before selection
 
 # -------------------------------------------------------------------------
 # MATH ENGINE
@@ -105,126 +126,685 @@ def delta_e_ciede2000(lab1, lab2):
 	R_T = -math.sin(math.radians(2 * delta_theta)) * R_C
 	return math.sqrt((delta_L_p / S_L)**2 + (delta_C_p / S_C)**2 + (delta_H_p / S_H)**2 + R_T * (delta_C_p / S_C) * (delta_H_p / S_H))
 
+# --- Vectorized kernels ---
+# Array counterparts of the scalar functions above. They follow the same
+# operation order so that the batched solver reproduces the scalar scores.
+
+def cmyk_to_rgb_array(cmyk):
+	""" (..., 4) CMYK -> (..., 3) RGB, see cmyk_to_rgb_naive """
+	cmyk = np.asarray(cmyk, dtype=np.float64)
+	k = 1.0 - cmyk[..., 3:]
+	return (1.0 - cmyk[..., :3]) * k
+
+def rgb_to_lab_array(rgb):
+	""" (..., 3) sRGB -> (..., 3) CIELAB (D65), see rgb_to_lab """
+	rgb = np.asarray(rgb, dtype=np.float64)
+	lin = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+	r, g, b = lin[..., 0], lin[..., 1], lin[..., 2]
+	X = r*0.4124 + g*0.3576 + b*0.1805
+	Y = r*0.2126 + g*0.7152 + b*0.0722
+	Z = r*0.0193 + g*0.1192 + b*0.9505
+	xn, yn, zn = 0.95047, 1.0, 1.08883
+	func2 = lambda t: np.where(t > 0.008856, np.power(t, 1/3), 7.787*t + 16/116)
+	fX, fY, fZ = func2(X/xn), func2(Y/yn), func2(Z/zn)
+	return np.stack((116*fY-16, 500*(fX-fY), 200*(fY-fZ)), axis=-1)
+
+def distance_rgb_euclidean_array(rgb1, rgb2):
+	""" Euclidean distance on 0-255 scale, broadcasting over leading axes """
+	d = np.asarray(rgb1, dtype=np.float64) * 255.0 - np.asarray(rgb2, dtype=np.float64) * 255.0
+	return np.sqrt(d[..., 0]**2 + d[..., 1]**2 + d[..., 2]**2)
+
+def delta_e_ciede2000_array(lab1, lab2):
+	""" CIEDE2000, broadcasting over leading axes """
+	lab1 = np.asarray(lab1, dtype=np.float64); lab2 = np.asarray(lab2, dtype=np.float64)
+	L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+	L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+	C1 = np.sqrt(a1**2 + b1**2); C2 = np.sqrt(a2**2 + b2**2); avg_C = (C1 + C2) / 2.0
+	G = 0.5 * (1 - np.sqrt(avg_C**7 / (avg_C**7 + 25**7)))
+	a1_p = (1 + G) * a1; a2_p = (1 + G) * a2
+	C1_p = np.sqrt(a1_p**2 + b1**2); C2_p = np.sqrt(a2_p**2 + b2**2); avg_C_p = (C1_p + C2_p) / 2.0
+	h1_p = np.where(C1_p == 0, 0.0, np.degrees(np.arctan2(b1, a1_p)) % 360)
+	h2_p = np.where(C2_p == 0, 0.0, np.degrees(np.arctan2(b2, a2_p)) % 360)
+	diff_h = h2_p - h1_p
+	close = np.abs(h1_p - h2_p) <= 180
+	delta_h_p = np.where(close, diff_h, np.where(h2_p <= h1_p, diff_h + 360, diff_h - 360))
+	delta_L_p = L2 - L1; delta_C_p = C2_p - C1_p
+	delta_H_p = 2 * np.sqrt(C1_p * C2_p) * np.sin(np.radians(delta_h_p) / 2.0)
+	avg_L_p = (L1 + L2) / 2.0
+	sum_h = h1_p + h2_p
+	avg_h_p = np.where(close, sum_h / 2.0, np.where(sum_h < 360, (sum_h + 360) / 2.0, (sum_h - 360) / 2.0))
+	T = 1 - 0.17 * np.cos(np.radians(avg_h_p - 30)) + 0.24 * np.cos(np.radians(2 * avg_h_p)) + 0.32 * np.cos(np.radians(3 * avg_h_p + 6)) - 0.20 * np.cos(np.radians(4 * avg_h_p - 63))
+	S_L = 1 + (0.015 * (avg_L_p - 50)**2) / np.sqrt(20 + (avg_L_p - 50)**2)
+	S_C = 1 + 0.045 * avg_C_p; S_H = 1 + 0.015 * avg_C_p * T
+	delta_theta = 30 * np.exp(-((avg_h_p - 275) / 25)**2)
+	R_C = 2 * np.sqrt(avg_C_p**7 / (avg_C_p**7 + 25**7))
+	R_T = -np.sin(np.radians(2 * delta_theta)) * R_C
+	return np.sqrt((delta_L_p / S_L)**2 + (delta_C_p / S_C)**2 + (delta_H_p / S_H)**2 + R_T * (delta_C_p / S_C) * (delta_H_p / S_H))
+
 # -------------------------------------------------------------------------
 # DATA LOADING
 # -------------------------------------------------------------------------
-def load_data():
-	""" Downloads color definitions and injects the 19 standard LaTeX base colors. """
-	print(f"Downloading data from: {DEFAULT_CSV_URL}")
+# The 19 standard LaTeX base colors (RGB definitions), as in xcolor.
+# They are injected after the CSV and overwrite it, to ensure 'green' is
+# PURE green, not dvips Green.
+STANDARD_BASES_RGB = {
+	"red":       (1.0, 0.0, 0.0),
+	"green":     (0.0, 1.0, 0.0),
+	"blue":      (0.0, 0.0, 1.0),
+	"cyan":      (0.0, 1.0, 1.0),
+	"magenta":   (1.0, 0.0, 1.0),
+	"yellow":    (1.0, 1.0, 0.0),
+	"black":     (0.0, 0.0, 0.0),
+	"white":     (1.0, 1.0, 1.0),
+	"gray":      (0.5, 0.5, 0.5),
+	"darkgray":  (0.25, 0.25, 0.25),
+	"lightgray": (0.75, 0.75, 0.75),
+	"brown":     (0.75, 0.5, 0.25),
+	"lime":      (0.75, 1.0, 0.0),
+	"olive":     (0.5, 0.5, 0.0),
+	"orange":    (1.0, 0.5, 0.0),
+	"pink":      (1.0, 0.75, 0.75),
+	"purple":    (0.75, 0.0, 0.25),
+	"teal":      (0.0, 0.5, 0.5),
+	"violet":    (0.5, 0.0, 0.5)
+}
+
+class Palette(namedtuple("Palette", ["names", "cmyk"])):
+	""" Parsed color table: a tuple of names and an (N, 4) float64 CMYK array. """
+	__slots__ = ()
+	
+	def to_dict(self):
+		return {name: tuple(vec) for name, vec in zip(self.names, self.cmyk.tolist())}
+	
+	@classmethod
+	def from_dict(cls, colors):
+		cmyk = np.array(list(colors.values()), dtype=np.float64).reshape(-1, 4)
+		cmyk.flags.writeable = False
+		return cls(tuple(colors), cmyk)
+
+_PALETTE_MEMO = {}
+
+def _is_url(source):
+	return source.startswith(("http://", "https://"))
+
+def _read_source(source):
+	""" Returns the CSV text of a palette source: bundled copy, local path, or cached URL. """
+	if source is None:
+		return pkgutil.get_data("sharpen", BUNDLED_CSV).decode("utf-8")
+	if not _is_url(source):
+		with open(source, encoding="utf-8") as f:
+			return f.read()
+	
+	key = hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+	path = cache_dir(f"palette-{key}.csv")
+	if os.path.exists(path):
+		with open(path, encoding="utf-8") as f:
+			return f.read()
+	
+	print(f"Downloading data from: {source}")
+	with urllib.request.urlopen(source, timeout=30) as response:
+		text = response.read().decode("utf-8")
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	tmp = f"{path}.{os.getpid()}.tmp"
+	with open(tmp, "w", encoding="utf-8") as f:
+		f.write(text)
+	os.replace(tmp, path)
+	return text
+
+def _parse_csv(text):
+	""" name,hex CSV -> {name: cmyk} """
 	colors = {}
+	reader = csv.reader(io.StringIO(text))
+	header = [h.strip().lower() for h in next(reader, [])]
+	if 'name' not in header or 'hex' not in header:
+		return colors
+	i_name, i_hex = header.index('name'), header.index('hex')
+	for row in reader:
+		if len(row) <= max(i_name, i_hex): continue
+		name = row[i_name].strip()
+		hex_val = row[i_hex].strip().lstrip('#')
+		if len(hex_val) != 6: continue
+		try:
+			colors[name] = rgb_to_cmyk_naive(*parse_hex(hex_val))
+		except ValueError: continue
+	return colors
+
+def load_palette(source=None):
+	"""
+	Load color definitions as a Palette and inject the 19 standard LaTeX base colors.
+	
+	source is a local CSV path or URL with 'name' and 'hex' columns; None
+	selects the bundled dvipsnames copy. URLs are downloaded once into
+	cache_dir(), and every parsed source is memoized for the process.
+	"""
+	if source in _PALETTE_MEMO:
+		return _PALETTE_MEMO[source]
 	
 	# 1. Load the fancy names (dvipsnames) from CSV
 	try:
-		df = pd.read_csv(DEFAULT_CSV_URL)
-		df.columns = df.columns.str.strip().str.lower()
-		
-		for _, row in df.iterrows():
-			if 'name' not in row or 'hex' not in row: continue
-			name = str(row['name']).strip()
-			hex_val = str(row['hex']).strip().lstrip('#')
-			if len(hex_val) != 6: continue
-			
-			try:
-				r = int(hex_val[0:2], 16) / 255.0
-				g = int(hex_val[2:4], 16) / 255.0
-				b = int(hex_val[4:6], 16) / 255.0
-				colors[name] = rgb_to_cmyk_naive(r, g, b)
-			except: continue
+		colors = _parse_csv(_read_source(source))
 	except Exception as e:
-		print(f"Warning: Could not load CSV ({e}). Using base colors only.")
-	
-	# 2. Inject the 19 Standard LaTeX Base Colors (RGB definitions)
-	# These match the standard xcolor definitions shown in your image.
-	standard_bases_rgb = {
-		"red":       (1.0, 0.0, 0.0),
-		"green":     (0.0, 1.0, 0.0),
-		"blue":      (0.0, 0.0, 1.0),
-		"cyan":      (0.0, 1.0, 1.0),
-		"magenta":   (1.0, 0.0, 1.0),
-		"yellow":    (1.0, 1.0, 0.0),
-		"black":     (0.0, 0.0, 0.0),
-		"white":     (1.0, 1.0, 1.0),
-		"gray":      (0.5, 0.5, 0.5),
-		"darkgray":  (0.25, 0.25, 0.25),
-		"lightgray": (0.75, 0.75, 0.75),
-		"brown":     (0.75, 0.5, 0.25),
-		"lime":      (0.75, 1.0, 0.0),
-		"olive":     (0.5, 0.5, 0.0),
-		"orange":    (1.0, 0.5, 0.0),
-		"pink":      (1.0, 0.75, 0.75),
-		"purple":    (0.75, 0.0, 0.25),
-		"teal":      (0.0, 0.5, 0.5),
-		"violet":    (0.5, 0.0, 0.5)
-	}
-	
-	# Convert these RGBs to your script's CMYK format and add them
-	for name, (r, g, b) in standard_bases_rgb.items():
-		# Only add if not already present (standard bases usually take precedence)
-		# Note: We overwrite here to ensure 'green' is PURE green, not dvips Green.
+		print(f"Warning: Could not load CSV ({e}). Using bundled dvipsnames.")
+		colors = _parse_csv(_read_source(None))
+	
+	# 2. Inject the standard base colors
+	for name, (r, g, b) in STANDARD_BASES_RGB.items():
 		colors[name] = rgb_to_cmyk_naive(r, g, b)
 	
-	print(f" -> Loaded {len(colors)} valid colors (including {len(standard_bases_rgb)} standard bases).")
-	return colors
+	print(f" -> Loaded {len(colors)} valid colors (including {len(STANDARD_BASES_RGB)} standard bases).")
+	palette = _PALETTE_MEMO[source] = Palette.from_dict(colors)
+	return palette
+
+def load_data(source=None):
+	""" Color definitions as a {name: cmyk} dict, see load_palette. """
+	return load_palette(source).to_dict()
+
+def _as_palette(palette):
+	""" Accepts a Palette, a {name: cmyk} dict or a load_palette source. """
+	if isinstance(palette, Palette):
+		return palette
+	if isinstance(palette, dict):
+		return Palette.from_dict(palette)
+	return load_palette(palette)
+	
 	
 # -------------------------------------------------------------------------
 # OPTIMIZER
 # -------------------------------------------------------------------------
-def solve(target_hex, max_bangs, metric, beam_width, step_size):
-	base_colors = load_data()
+def _metric_coords(metric, rgb):
+	""" Coordinates the metric measures distances in: Lab for 'lab', else RGB. """
+	return rgb_to_lab_array(rgb) if metric == 'lab' else rgb
+
+def _distance_kernel(metric, t_rgb):
+	""" Returns a vectorized (..., 3) coordinates -> distance-to-target kernel. """
+	if metric == 'lab':
+		t_lab = np.array(rgb_to_lab(t_rgb))
+		return lambda lab: delta_e_ciede2000_array(lab, t_lab)
+	t_arr = np.array(t_rgb)
+	return lambda rgb: distance_rgb_euclidean_array(rgb, t_arr)
+
+def _smallest_indices(gaps, k):
+	""" Flat indices of the k smallest finite gaps, ties broken by position (as heapq.nsmallest). """
+	flat = gaps.ravel()
+	if k < flat.size:
+		kth = np.partition(flat, k - 1)[k - 1]
+		idx = np.flatnonzero(flat <= kth)
+	else:
+		idx = np.arange(flat.size)
+	idx = idx[np.argsort(flat[idx], kind='stable')][:k]
+	return idx[np.isfinite(flat[idx])]
+
+def _first_distinct(vecs):
+	""" Sorted indices of the first occurrence of each distinct CMYK vector. """
+	_, first = np.unique(np.round(vecs, 12), axis=0, return_index=True)
+	return np.sort(first)
+
+def _mix_arrays(c_vecs, b_vecs, ratios, pairwise=False):
+	""" Vectorized cmyk_mix: all candidates x bases x ratios, or row-aligned triples if pairwise. """
+	if pairwise:
+		r = ratios[:, None]
+		return r * c_vecs + (1.0 - r) * b_vecs
+	r = ratios[None, None, :, None]
+	return r * c_vecs[:, None, None, :] + (1.0 - r) * b_vecs[None, :, None, :]
+
+def _result(gap, vec, expr, rgb):
+	return (float(gap), tuple(vec.tolist()), expr, tuple(rgb.tolist()))
+
+class MixTables:
+	"""
+	Target-independent search data for one palette and step size: the base
+	colors, mixing ratios, the no-op mixing mask and every depth-1 mix.
+	Build it once and pass it to solve() / solve_many() for several targets.
+	"""
+	def __init__(self, palette=None, step_size=5):
+		self.palette = _as_palette(palette)
+		self.names = list(self.palette.names)
+		self.base_vecs = self.palette.cmyk
+		self.step_size = step_size
+		self.percents = list(range(step_size, 100, step_size))
+		self.ratios = np.array(self.percents, dtype=np.float64) / 100.0
+		# skip[i, j]: mixing base j onto an expression ending in base i is a no-op
+		self.skip = np.array([[a.endswith(b) for b in self.names] for a in self.names], dtype=bool)
+		self.white = self.names.index("White") if "White" in self.names else None
+		self.base_rgbs = cmyk_to_rgb_array(self.base_vecs)
+		
+		# Depth-1 mixing partners, in scan order: every base, then the
+		# implicit White for bare (depth 0) names.
+		self.first_partners = np.arange(len(self.names))
+		if self.white is not None:
+			self.first_partners = np.append(self.first_partners, self.white)
+		self.first_vecs = _mix_arrays(self.base_vecs, self.base_vecs[self.first_partners], self.ratios)
+		self.first_rgbs = cmyk_to_rgb_array(self.first_vecs)
+		self._coords = {}
 	
-	t_rgb = parse_hex(target_hex)
-	t_lab = rgb_to_lab(t_rgb) if metric == 'lab' else None
+	def coords(self, metric):
+		""" (base, depth-1) coordinates in the metric's space, computed once per metric. """
+		if metric not in self._coords:
+			self._coords[metric] = (_metric_coords(metric, self.base_rgbs), _metric_coords(metric, self.first_rgbs))
+		return self._coords[metric]
+	
+	def allowed(self, last, partners):
+		""" (candidates, partners) mask of mixes that are not no-ops; the implicit White always is. """
+		allowed = ~self.skip[last][:, partners]
+		if len(partners) > len(self.names):
+			allowed[:, len(self.names):] = True
+		return allowed
+
+class _Generation:
+	"""
+	Fixed-size top-k of one beam-search generation, kept sorted by (gap, scan
+	position). Expressions are stored as (parent row, partner base, percent)
+	records into the previous generation and only rendered on demand.
+	"""
+	def __init__(self, k, dedup):
+		self.k, self.dedup = k, dedup
+		self.gaps = np.empty(0)
+		self.pos = np.empty(0, dtype=np.int64)
+		self.vecs = np.empty((0, 4))
+		self.parent = self.partner = self.pct = np.empty(0, dtype=np.int64)
+	
+	def __len__(self):
+		return len(self.gaps)
+	
+	def threshold(self):
+		""" Gap a new mix must not exceed to enter. """
+		return self.gaps[-1] if len(self) >= self.k else np.inf
+	
+	def push(self, gaps, pos, vecs, parent, partner, pct):
+		gaps = np.concatenate([self.gaps, gaps]); pos = np.concatenate([self.pos, pos])
+		vecs = np.concatenate([self.vecs, vecs])
+		order = np.lexsort((pos, gaps))
+		if self.dedup:
+			# Equal CMYK vectors have equal gaps; keep the first one in (gap, position) order
+			order = order[_first_distinct(vecs[order])]
+		order = order[:self.k]
+		self.gaps, self.pos, self.vecs = gaps[order], pos[order], vecs[order]
+		self.parent = np.concatenate([self.parent, parent])[order]
+		self.partner = np.concatenate([self.partner, partner])[order]
+		self.pct = np.concatenate([self.pct, pct])[order]
+	
+	def truncate(self, k):
+		""" Keep the best k mixes, and only admit mixes that beat them from now on. """
+		self.k = k
+		self.gaps, self.pos, self.vecs = self.gaps[:k], self.pos[:k], self.vecs[:k]
+		self.parent, self.partner, self.pct = self.parent[:k], self.partner[:k], self.pct[:k]
+	
+	def refine(self, parents, base_vecs, score, step_size):
+		"""
+		Add, next to each mix, every integer percent within one coarse step
+		of its ratio (2 * (step_size - 1) neighbours), competing with the
+		coarse mixes for the generation's slots. Run on a pool wider than
+		the beam and truncate() afterwards, so the beam is selected from
+		refined mixes. Returns the number of mixes evaluated.
+		"""
+		offsets = np.array([o for o in range(1 - step_size, step_size) if o], dtype=np.int64)
+		if not len(self) or not offsets.size:
+			return 0
+		pcts = self.pct[:, None] + offsets
+		valid = (pcts > 0) & (pcts < 100)
+		r = (np.clip(pcts, 1, 99) / 100.0)[:, :, None]
+		vecs = r * parents.vecs[self.parent][:, None, :] + (1.0 - r) * base_vecs[self.partner][:, None, :]
+		gaps = np.where(valid, score(vecs), np.inf)
+		
+		rows, j = np.nonzero(valid)
+		self.push(gaps[rows, j], self.pos[rows], vecs[rows, j], self.parent[rows], self.partner[rows], pcts[rows, j])
+		return int(valid.sum())
+
+def _render(generations, row, names):
+	""" Expression text of a row of the last generation, following parent records. """
+	parts = []
+	for gen in reversed(generations[1:]):
+		parts.append(f"!{gen.pct[row]}!{names[gen.partner[row]]}")
+		row = gen.parent[row]
+	return names[generations[0].partner[row]] + "".join(reversed(parts))
+
+SearchDepth = namedtuple("SearchDepth", ["depth", "parents", "active", "candidates", "refined",
+										 "eval_time", "expand_time", "beam", "wall_time"])
+
+class SearchStats:
+	"""
+	Counters of one beam search, one SearchDepth per depth searched: parents
+	in the beam and left after pruning, mixes scored by the expansion and by
+	refinement, seconds spent in distance evaluation and in the rest of the
+	expansion (mixing, pruning, top-k upkeep; summed over workers), the
+	resulting beam size and the depth's wall time.
+	"""
+	def __init__(self, beam_width):
+		self.beam_width = beam_width
+		self.depths = []
+	
+	def add(self, *fields):
+		self.depths.append(SearchDepth(*fields))
+	
+	@property
+	def evals(self):
+		return sum(d.candidates + d.refined for d in self.depths)
 	
-	def get_gap(cand_rgb):
-		if metric == 'lab':
-			return delta_e_ciede2000(rgb_to_lab(cand_rgb), t_lab)
+	@property
+	def wall_time(self):
+		return sum(d.wall_time for d in self.depths)
+	
+	def occupancy(self):
+		""" Fraction of the beam filled at each depth. """
+		return [d.beam / self.beam_width for d in self.depths]
+	
+	def to_dict(self):
+		return {"beam_width": self.beam_width, "depths": [d._asdict() for d in self.depths]}
+	
+	def __str__(self):
+		lines = [f"{'k':<3} | {'Parents':>9} | {'Active':>9} | {'Scored':>11} | {'Eval s':>7} | {'Expand s':>8} | {'Beam':>6} | {'Wall s':>7}"]
+		for d in self.depths:
+			lines.append(f"{d.depth:<3} | {d.parents:>9,} | {d.active:>9,} | {d.candidates + d.refined:>11,} | {d.eval_time:>7.3f} | "
+						 f"{d.expand_time:>8.3f} | {d.beam / self.beam_width:>6.1%} | {d.wall_time:>7.3f}")
+		return "\n".join(lines)
+
+def _box_lower_bound(metric, t_rgb, lo, hi):
+	"""
+	Lower bound of the metric distance from t_rgb to any CMYK vector inside
+	the box [lo, hi]. RGB is decreasing in every CMYK component, so the box
+	maps into an RGB box; for 'lab' only the lightness term is bounded,
+	using S_L <= 1.75 on [0, 100].
+	"""
+	rgb_lo = (1.0 - hi[..., :3]) * (1.0 - hi[..., 3:])
+	rgb_hi = (1.0 - lo[..., :3]) * (1.0 - lo[..., 3:])
+	if metric == 'lab':
+		t_L = rgb_to_lab(t_rgb)[0]
+		L_lo, L_hi = rgb_to_lab_array(rgb_lo)[..., 0], rgb_to_lab_array(rgb_hi)[..., 0]
+		return np.maximum(np.maximum(L_lo - t_L, t_L - L_hi), 0.0) / 1.75
+	t = np.array(t_rgb)
+	d = np.maximum(np.maximum(rgb_lo - t, t - rgb_hi), 0.0) * 255.0
+	return np.sqrt((d ** 2).sum(axis=-1))
+
+def _expand(tables, metric, t_rgb, k, vecs, partner, chunks, nxt, pair_prune=None, deadline=None, eval_budget=None):
+	"""
+	Score the mixes of the given chunks of parent rows (vecs, partner) and
+	push each chunk's best into nxt. pair_prune = (incumbent, w_lo, w_hi)
+	skips parent x partner pairs that cannot beat the incumbent. Stops
+	early past deadline or eval_budget. Returns the number of mixes scored,
+	the seconds spent scoring them and the seconds spent overall.
+	"""
+	start = time.perf_counter()
+	eval_time = 0.0
+	distance = _distance_kernel(metric, t_rgb)
+	base_vecs, ratios = tables.base_vecs, tables.ratios
+	percents = np.array(tables.percents, dtype=np.int64)
+	partners = tables.first_partners if k == 1 else np.arange(len(tables.names))
+	block = (len(partners), len(ratios))
+	evals = 0
+	
+	for ids in chunks:
+		if eval_budget is not None:
+			# Only take the rows the budget still covers (a row scores at most one block)
+			ids = ids[:max(1, -(-(eval_budget - evals) // (block[0] * block[1])))]
+		allowed = tables.allowed(partner[ids], partners)
+		if pair_prune is not None:
+			incumbent, w_lo, w_hi = pair_prune
+			w = np.array([w_lo, w_hi])[:, None, None, None]
+			corners = w * vecs[ids][None, :, None, :] + (1.0 - w) * base_vecs[partners][None, None, :, :]
+			allowed &= _box_lower_bound(metric, t_rgb, corners.min(axis=0), corners.max(axis=0)) <= incumbent
+		
+		c_idx, b_idx = np.nonzero(allowed)
+		tick = time.perf_counter()
+		if k == 1:
+			# Candidates are bare bases: their mixes are already tabulated
+			coords = tables.coords(metric)[1][partner[ids][c_idx], b_idx]
 		else:
-			return distance_rgb_euclidean(cand_rgb, t_rgb)
+			r = ratios[None, :, None]
+			mixed = r * vecs[ids][c_idx][:, None, :] + (1.0 - r) * base_vecs[partners][b_idx][:, None, :]
+			coords = _metric_coords(metric, cmyk_to_rgb_array(mixed))
+		gaps = distance(coords)
+		eval_time += time.perf_counter() - tick
+		evals += gaps.size
+		
+		candidates = np.flatnonzero(gaps.ravel() <= nxt.threshold())
+		take = nxt.k
+		while True:
+			flat = candidates[_smallest_indices(gaps.ravel()[candidates], take)]
+			pair, p_idx = np.unravel_index(flat, gaps.shape)
+			parent, b = ids[c_idx[pair]], b_idx[pair]
+			mixed = _mix_arrays(vecs[parent], base_vecs[partners[b]], ratios[p_idx], pairwise=True)
+			# push() drops duplicates, so select until the chunk's best k distinct mixes are in
+			if not nxt.dedup or take >= candidates.size or len(_first_distinct(mixed)) >= nxt.k:
+				break
+			take *= 2
+		if flat.size:
+			pos = (parent * block[0] + b) * block[1] + p_idx
+			nxt.push(gaps.ravel()[flat], pos, mixed, parent, partners[b], percents[p_idx])
+		if (deadline is not None and time.monotonic() >= deadline) or (eval_budget is not None and evals >= eval_budget):
+			break
+	return evals, eval_time, time.perf_counter() - start
+
+_WORKER_SEARCH = None
+
+def _init_expand_worker(tables, metric, t_rgb):
+	global _WORKER_SEARCH
+	_WORKER_SEARCH = (tables, metric, t_rgb)
+
+def _expand_in_worker(args):
+	""" _expand() over a shard of chunks, reading the parent generation from shared memory. """
+	k, shm_name, n, chunks, beam_width, dedup, pair_prune, deadline, eval_budget = args
+	tables, metric, t_rgb = _WORKER_SEARCH
+	shm = shared_memory.SharedMemory(name=shm_name)
+	vecs = np.ndarray((n, 4), dtype=np.float64, buffer=shm.buf)
+	partner = np.ndarray((n,), dtype=np.int64, buffer=shm.buf, offset=vecs.nbytes)
+	try:
+		local = _Generation(beam_width, dedup)
+		counts = _expand(tables, metric, t_rgb, k, vecs, partner, chunks, local, pair_prune, deadline, eval_budget)
+		return (local.gaps, local.pos, local.vecs, local.parent, local.partner, local.pct), counts
+	finally:
+		del vecs, partner
+		shm.close()
+
+def _expand_parallel(pool, workers, k, cur, chunks, nxt, pair_prune, deadline, eval_budget):
+	"""
+	_expand() sharded over a process pool. Each worker keeps a local top-k of
+	its chunks; merging those gives the same generation as the serial loop,
+	since the (gap, position) top-k of a union is the top-k of the parts' top-ks.
+	An eval_budget is split evenly over the shards.
+	"""
+	n = len(cur)
+	shm = shared_memory.SharedMemory(create=True, size=n * 4 * 8 + n * 8)
+	try:
+		np.ndarray((n, 4), dtype=np.float64, buffer=shm.buf)[:] = cur.vecs
+		np.ndarray((n,), dtype=np.int64, buffer=shm.buf, offset=n * 4 * 8)[:] = cur.partner
+		shards = [shard for shard in (chunks[i::workers] for i in range(workers)) if shard]
+		budgets = [None] * len(shards)
+		if eval_budget is not None:
+			# Split the budget so all shards together spend what the serial loop would
+			budgets = [eval_budget // len(shards) + (i < eval_budget % len(shards)) for i in range(len(shards))]
+			shards, budgets = [s for s, b in zip(shards, budgets) if b > 0], [b for b in budgets if b > 0]
+		tasks = [(k, shm.name, n, shard, nxt.k, nxt.dedup, pair_prune, deadline, budget) for shard, budget in zip(shards, budgets)]
+		totals = np.zeros(3)
+		for arrays, counts in pool.map(_expand_in_worker, tasks):
+			nxt.push(*arrays)
+			totals += counts
+		return int(totals[0]), totals[1], totals[2]
+	finally:
+		shm.close()
+		shm.unlink()
+
+def _search(tables, t_rgb, max_bangs, metric, beam_width, dedup=True, refine=False,
+			time_budget=None, max_evals=None, prune=False, callback=None, workers=None, stats=None):
+	""" Beam search against precomputed MixTables, see solve(). Fills stats (a SearchStats) if given. """
+	distance = _distance_kernel(metric, t_rgb)
+	score = lambda vecs: distance(_metric_coords(metric, cmyk_to_rgb_array(vecs)))
+	base_coords, _ = tables.coords(metric)
+	names, base_vecs, ratios = tables.names, tables.base_vecs, tables.ratios
+	deadline = None if time_budget is None else time.monotonic() + time_budget
+	evals = 0
+	
+	def expired():
+		return (deadline is not None and time.monotonic() >= deadline) or (max_evals is not None and evals >= max_evals)
+	
+	def record(k, generations):
+		gen = generations[-1]
+		best_results[k] = _result(gen.gaps[0], gen.vecs[0], _render(generations, 0, names), cmyk_to_rgb_array(gen.vecs[0]))
+		if callback is not None:
+			callback(k, best_results[k])
 	
 	# Depth 0
-	current_gen = []
-	for name, vec in base_colors.items():
-		c_rgb = cmyk_to_rgb_naive(vec)
-		gap = get_gap(c_rgb)
-		current_gen.append((gap, vec, name, c_rgb))
-	
-	best_results = {0: min(current_gen, key=lambda x: x[0])}
-	
-	# Depth 1..N
-	for k in range(1, max_bangs + 1):
-		next_gen = []
-		candidates = heapq.nsmallest(beam_width, current_gen, key=lambda x: x[0])
-		
-		for (c_gap, c_vec, c_expr, c_rgb_val) in candidates:
-			# Mix
-			for b_name, b_vec in base_colors.items():
-				if c_expr.endswith(b_name): continue
-				for p in range(step_size, 100, step_size):
-					n_vec = cmyk_mix(c_vec, b_vec, p)
-					n_expr = f"{c_expr}!{p}!{b_name}"
-					n_rgb = cmyk_to_rgb_naive(n_vec)
-					n_gap = get_gap(n_rgb)
-					next_gen.append((n_gap, n_vec, n_expr, n_rgb))
+	started = time.perf_counter()
+	bases = np.arange(len(names))
+	none = np.full(len(names), -1)
+	gen = _Generation(beam_width, dedup)
+	gaps = distance(base_coords)
+	eval_time = time.perf_counter() - started
+	gen.push(gaps, bases, base_vecs, none, bases, none)
+	evals += len(names)
+	if stats is not None:
+		stats.add(0, 0, 0, len(names), 0, eval_time, time.perf_counter() - started - eval_time, len(gen), time.perf_counter() - started)
+	generations = [gen]
+	best_results = {}
+	record(0, generations)
+	
+	# Weight a parent keeps through one mix, and the palette's CMYK box
+	w_lo = (1 if refine else tables.step_size) / 100.0
+	w_hi = 1.0 - w_lo
+	hull_lo, hull_hi = base_vecs.min(axis=0), base_vecs.max(axis=0)
+	
+	pool = None
+	if workers is not None and workers > 1:
+		pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_expand_worker, initargs=(tables, metric, t_rgb))
+	
+	try:
+		# Depth 1..N: stream candidate x partner x ratio blocks into the next top-k
+		for k in range(1, max_bangs + 1):
+			if expired():
+				break
+			started = time.perf_counter()
+			cur = generations[-1]
+			n_partners = len(tables.first_partners) if k == 1 else len(names)
+			rows = max(1, EVAL_CHUNK_SIZE // (n_partners * len(ratios)))
+			# With refine, a wider coarse pool is refined before the beam is selected,
+			# so a fine optimum whose coarse neighbour ranks just outside the beam survives
+			nxt = _Generation(beam_width * REFINE_POOL if refine else beam_width, dedup)
+			
+			# Pruning: drop parents (or, at the last depth, parent x partner
+			# pairs) whose descendants cannot beat the best gap found so far.
+			incumbent = min(r[0] for r in best_results.values())
+			remaining = max_bangs - k + 1
+			active = np.arange(len(cur))
+			if prune and remaining > 1:
+				w = np.array([w_lo ** remaining, w_hi])[:, None, None, None]
+				hull = np.stack([hull_lo, hull_hi])[None, :, None, :]
+				corners = (w * cur.vecs[None, None] + (1.0 - w) * hull).reshape(4, len(cur), 4)
+				bound = _box_lower_bound(metric, t_rgb, corners.min(axis=0), corners.max(axis=0))
+				active = active[bound <= incumbent]
+			pair_prune = (incumbent, w_lo, w_hi) if prune and remaining == 1 else None
 			
-			# Implicit White (Depth 1 only)
-			if k == 1 and "!" not in c_expr:
-				for p in range(step_size, 100, step_size):
-					n_vec = cmyk_mix(c_vec, base_colors["White"], p)
-					n_expr = f"{c_expr}!{p}!White"
-					n_rgb = cmyk_to_rgb_naive(n_vec)
-					n_gap = get_gap(n_rgb)
-					next_gen.append((n_gap, n_vec, n_expr, n_rgb))
-	
-		if next_gen:
-			best_results[k] = min(next_gen, key=lambda x: x[0])
-			current_gen = next_gen
+			chunks = [active[start:start + rows] for start in range(0, len(active), rows)]
+			eval_budget = None if max_evals is None else max_evals - evals
+			if pool is not None and len(chunks) > 1:
+				scored, eval_time, busy = _expand_parallel(pool, workers, k, cur, chunks, nxt, pair_prune, deadline, eval_budget)
+			else:
+				scored, eval_time, busy = _expand(tables, metric, t_rgb, k, cur.vecs, cur.partner, chunks, nxt, pair_prune, deadline, eval_budget)
+			evals += scored
 			
-	return t_rgb, best_results
+			refined = 0
+			if len(nxt) and refine and not expired():
+				refined = nxt.refine(cur, base_vecs, score, tables.step_size)
+				evals += refined
+			nxt.truncate(beam_width)
+			if stats is not None:
+				stats.add(k, len(cur), len(active), scored, refined, eval_time, busy - eval_time, len(nxt), time.perf_counter() - started)
+			if not len(nxt):
+				continue
+			generations.append(nxt)
+			record(k, generations)
+	finally:
+		if pool is not None:
+			pool.shutdown()
+	
+	return best_results
+
+def _tables_for(palette, step_size):
+	if isinstance(palette, MixTables):
+		if palette.step_size != step_size:
+			raise ValueError(f"MixTables were built for step {palette.step_size}, not {step_size}")
+		return palette
+	return MixTables(palette, step_size)
+
+def solve(target_hex, max_bangs, metric, beam_width, step_size, palette=None, dedup=True, refine=False,
+		  time_budget=None, max_evals=None, prune=False, callback=None, workers=None, return_stats=False):
+	"""
+	Beam search for xcolor '!' expressions approximating target_hex.
+	
+	palette is a Palette, a {name: cmyk} dict, a CSV source for
+	load_palette (None for the bundled dvipsnames) or prebuilt MixTables.
+	With dedup, mixes with the same CMYK vector take a single beam slot.
+	With refine, step_size is a coarse grid: each generation keeps
+	REFINE_POOL times the beam of coarse mixes, adds every 1% ratio within
+	one coarse step of them and only then selects the beam. This trades
+	accuracy for speed: results usually match step_size=1, but from depth 2
+	on they can fall slightly short of it when the fine optimum's coarse
+	neighbours rank outside the pool.
+	
+	Anytime use: the search stops once time_budget seconds or max_evals
+	scored mixes are spent and returns the depths finished so far (the
+	interrupted depth holds the best of what it scored). With prune,
+	branches whose bounded best reachable gap cannot beat the best gap
+	found so far are skipped; this keeps the overall best but may change
+	the per-depth entries. callback(depth, result) is called as each
+	depth's best result becomes available.
+	
+	With workers > 1, each generation's expansion is sharded over that many
+	processes, which read the beam from shared memory; results are the
+	same as the serial search. max_evals stays a total over all workers
+	(each gets an equal share of what is left), so a budgeted search
+	scores as many mixes as the serial one, though not the same ones.
+	
+	Returns the target RGB and {depth: (gap, cmyk, expression, rgb)}, plus
+	a SearchStats of the run if return_stats.
+	"""
+	tables = _tables_for(palette, step_size)
+	t_rgb = parse_hex(target_hex)
+	stats = SearchStats(beam_width) if return_stats else None
+	best_results = _search(tables, t_rgb, max_bangs, metric, beam_width, dedup=dedup, refine=refine,
+						   time_budget=time_budget, max_evals=max_evals, prune=prune, callback=callback,
+						   workers=workers, stats=stats)
+	return (t_rgb, best_results, stats) if return_stats else (t_rgb, best_results)
+
+_WORKER_TABLES = None
+
+def _init_worker(tables):
+	global _WORKER_TABLES
+	_WORKER_TABLES = tables
+
+def _solve_in_worker(args):
+	target_hex, max_bangs, metric, beam_width, options = args
+	t_rgb = parse_hex(target_hex)
+	return t_rgb, _search(_WORKER_TABLES, t_rgb, max_bangs, metric, beam_width, **options)
+
+def solve_many(targets, max_bangs, metric, beam_width, step_size, palette=None, workers=None, **options):
+	"""
+	solve() for several target hex codes, sharing the palette and depth-1
+	mixes. Targets are searched in a process pool of `workers` processes
+	(default: one per CPU, 1 to stay in-process). Other keyword options are
+	those of solve(); a callback is only supported in-process.
+	
+	Returns a list of (t_rgb, best_results), in the order of targets.
+	"""
+	targets = list(targets)
+	tables = _tables_for(palette, step_size)
+	tables.coords(metric)
+	
+	workers = min(workers or os.cpu_count() or 1, len(targets))
+	if workers <= 1:
+		return [solve(t, max_bangs, metric, beam_width, step_size, palette=tables, **options) for t in targets]
+	
+	tasks = [(t, max_bangs, metric, beam_width, options) for t in targets]
+	with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(tables,)) as pool:
+		return list(pool.map(_solve_in_worker, tasks))
+
+def read_hex_file(path):
+	""" Target hex codes from a text file, separated by newlines, spaces or commas. """
+	with open(path) as f:
+		return [t for t in f.read().replace(',', ' ').split() if t]
 
 # -------------------------------------------------------------------------
 # LATEX GENERATOR
 # -------------------------------------------------------------------------
-def generate_latex(target_hex, results, metric_name):
+def _latex_section(target_hex, results, metric_name):
 	hex_clean = target_hex.lstrip('#').upper()
 	rows = ""
 	for k in sorted(results.keys()):
@@ -236,20 +816,30 @@ def generate_latex(target_hex, results, metric_name):
 	\colorbox{{{expr}}}{{\rule{{0pt}}{{1.5em}}\rule{{1.5em}}{{0pt}}}} & 
 	\small\texttt{{{expr}}} \\"""
 	
-	return rf"""\documentclass{{article}}
-\usepackage[dvipsnames]{{xcolor}}
-\usepackage[margin=1in]{{geometry}}
-\definecolor{{Target}}{{HTML}}{{{hex_clean}}}
-\begin{{document}}
+	return rf"""\definecolor{{Target}}{{HTML}}{{{hex_clean}}}
 \section*{{Color Matcher: \#{hex_clean}}}
 \textbf{{Metric:}} {metric_name}
 \renewcommand{{\arraystretch}}{{2}}
 \begin{{tabular}}{{c l l l l}}
     \textbf{{k}} & \textbf{{Diff}} & \textbf{{Simulated RGB}} & \textbf{{Vis}} & \textbf{{Code}} \\ \hline
     {rows}
-\end{{tabular}}
+\end{{tabular}}"""
+
+def _latex_document(body):
+	return rf"""\documentclass{{article}}
+\usepackage[dvipsnames]{{xcolor}}
+\usepackage[margin=1in]{{geometry}}
+\begin{{document}}
+{body}
 \end{{document}}"""
 
+def generate_latex(target_hex, results, metric_name):
+	return _latex_document(_latex_section(target_hex, results, metric_name))
+
+def generate_latex_report(matches, metric_name):
+	""" One document with a section per (target_hex, results) pair. """
+	return _latex_document("\n\n".join(_latex_section(h, res, metric_name) for h, res in matches))
+
 # -------------------------------------------------------------------------
 # MAIN CLI
 # -------------------------------------------------------------------------
@@ -259,7 +849,7 @@ def main():
 	parser.add_argument("-n", "--bangs", type=int, default=2, help="Max depth of mixing (default: 2)")
 	parser.add_argument("-m", "--metric", choices=['rgb', 'lab'], default='rgb', 
 						help="Distance metric: 'rgb' (Euclidean) or 'lab' (CIEDE2000)")
-	parser.add_argument("--csv", default=DEFAULT_CSV_URL, help="URL to dvipsnames.csv")
+	parser.add_argument("--csv", default=None, help=f"Local path or URL of a dvipsnames CSV (default: bundled copy of {DEFAULT_CSV_URL})")
 	parser.add_argument("--beam", type=int, default=1000, help="Beam search width (default: 1000)")
 	parser.add_argument("--step", type=int, default=5, help="Mixing step size (default: 5)")
 	parser.add_argument("--tex", action="store_true", help="Generate LaTeX report file")
@@ -271,7 +861,7 @@ def main():
 	print(f"Config: n={args.bangs}, beam={args.beam}, step={args.step}")
 	print(f"Metric: {args.metric.upper()} distance")
 	
-	t_rgb, res = solve(args.hex, args.bangs, args.metric, args.beam, args.step)
+	t_rgb, res = solve(args.hex, args.bangs, args.metric, args.beam, args.step, palette=args.csv)
 	
 	print("-" * 85)
 	print(f"{'k':<3} | {'Diff':<8} | {'Simulated RGB':<22} | {'Expression'}")
@@ -0,0 +1,280 @@
+"""
+Nearest-Neighbour Index for xcolor Mixes
+========================================
+
+For a fixed palette and step size the set of `a!p!b` (and `a!p!b!q!c`)
+expressions is finite and independent of the target, so it can be
+enumerated once, stored on disk, and queried with a spatial lookup
+instead of a beam search.
+
+Depth 0 and 1 hold every distinct mix. Depth 2 is too large for that, so
+it keeps one mix per 24-bit simulated RGB value (the one closest to that
+value). Its answers are therefore approximate: up to a cell diagonal
+(sqrt(3) on the 0-255 scale) further in RGB than the best depth-2 mix a
+full search would find, and the index still takes a few hundred MB at
+step 5. Points are indexed by a uniform grid in both RGB and Lab space.
+Queries take the k nearest points and re-rank them with the exact metric
+(Euclidean RGB or CIEDE2000).
+"""
+
+import os
+import numpy as np
+
+from .dvips_color_matcher import (
+	MixTables, EVAL_CHUNK_SIZE, parse_hex, cmyk_to_rgb_array,
+	_distance_kernel, _metric_coords, _mix_arrays, _result
+)
+
+INDEX_DEPTHS = (1, 2)
+SPACES = ('rgb', 'lab')
+
+_INDEX_MEMO = {}
+
+# -------------------------------------------------------------------------
+# SPATIAL GRID
+# -------------------------------------------------------------------------
+class _Grid:
+	""" Uniform grid over 3D points, stored as a cell-sorted permutation with CSR offsets. """
+	
+	def __init__(self, lo, cell, dims, offsets, order):
+		self.lo, self.cell, self.dims = lo, float(cell), dims
+		self.offsets, self.order = offsets, order
+	
+	@classmethod
+	def build(cls, points, points_per_cell=16):
+		points = np.asarray(points, dtype=np.float64)
+		lo, hi = points.min(axis=0), points.max(axis=0)
+		cells = int(np.clip(round((len(points) / points_per_cell) ** (1 / 3)), 1, 128))
+		cell = max(float((hi - lo).max()) / cells, 1e-9)
+		dims = np.floor((hi - lo) / cell).astype(np.int64) + 1
+		ids = cls._flat(np.floor((points - lo) / cell).astype(np.int64), dims)
+		order = np.argsort(ids, kind='stable').astype(np.int32)
+		offsets = np.concatenate([[0], np.cumsum(np.bincount(ids, minlength=int(dims.prod())))])
+		return cls(lo, cell, dims, offsets, order)
+	
+	@staticmethod
+	def _flat(coords, dims):
+		coords = np.minimum(coords, dims - 1)
+		return (coords[..., 0] * dims[1] + coords[..., 1]) * dims[2] + coords[..., 2]
+	
+	def _shell(self, center, r):
+		""" Flat ids of the cells at Chebyshev distance r from center. """
+		axes = [np.arange(max(c - r, 0), min(c + r, d - 1) + 1) for c, d in zip(center, self.dims)]
+		mesh = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+		mesh = mesh[np.abs(mesh - center).max(axis=1) == r]
+		return self._flat(mesh, self.dims)
+	
+	def nearest(self, points, q, k):
+		""" Indices of the (up to) k points closest to q, nearest first. """
+		q = np.asarray(q, dtype=np.float64)
+		center = np.clip(np.floor((q - self.lo) / self.cell).astype(np.int64), 0, self.dims - 1)
+		best_idx, best_d = np.empty(0, dtype=np.int64), np.empty(0)
+		for r in range(int(self.dims.max())):
+			ids = self._shell(center, r)
+			starts, ends = self.offsets[ids], self.offsets[ids + 1]
+			lens = ends - starts
+			if lens.sum():
+				pos = np.repeat(starts - np.concatenate([[0], np.cumsum(lens)[:-1]]), lens) + np.arange(lens.sum())
+				idx = self.order[pos].astype(np.int64)
+				d = np.sqrt(((points[idx] - q) ** 2).sum(axis=1))
+				best_idx, best_d = np.concatenate([best_idx, idx]), np.concatenate([best_d, d])
+				top = np.argsort(best_d, kind='stable')[:k]
+				best_idx, best_d = best_idx[top], best_d[top]
+			# Unvisited cells are at least r cells away from q
+			if len(best_d) >= k and best_d[-1] <= r * self.cell:
+				break
+		return best_idx
+	
+	def arrays(self, prefix):
+		return {f"{prefix}_lo": self.lo, f"{prefix}_cell": np.float64(self.cell), f"{prefix}_dims": self.dims,
+				f"{prefix}_offsets": self.offsets, f"{prefix}_order": self.order}
+	
+	@classmethod
+	def from_arrays(cls, data, prefix):
+		return cls(*(data[f"{prefix}_{f}"] for f in ('lo', 'cell', 'dims', 'offsets', 'order')))
+
+# -------------------------------------------------------------------------
+# INDEX
+# -------------------------------------------------------------------------
+def _rgb_keys(rgb):
+	""" Pack simulated RGB into 24-bit integer keys. """
+	q = np.rint(rgb * 255.0).astype(np.int64)
+	return (q[..., 0] << 16) | (q[..., 1] << 8) | q[..., 2]
+
+class MixIndex:
+	"""
+	Persistent index of every mix up to max_bangs (1 or 2) for one palette
+	and step size. Build with build_index(), reopen with MixIndex.load().
+	
+	Nodes are the depth 0 bases and the distinct depth-1 mixes; each point
+	at depth d is a node (d <= 1) or a node mixed with one more base (d = 2).
+	"""
+	
+	def __init__(self, data):
+		self.names = [str(n) for n in data["names"]]
+		self.cmyk = data["cmyk"]
+		self.percents = [int(p) for p in data["percents"]]
+		self.step_size = int(data["step_size"])
+		self.max_bangs = int(data["max_bangs"])
+		self.node_parent, self.node_partner, self.node_pct = data["node_parent"], data["node_partner"], data["node_pct"]
+		self.node_cmyk = data["node_cmyk"]
+		self.depths = []
+		for d in range(self.max_bangs + 1):
+			self.depths.append({
+				"node": data[f"d{d}_node"], "partner": data[f"d{d}_partner"], "pct": data[f"d{d}_pct"],
+				"coords": {s: data[f"d{d}_{s}"] for s in SPACES},
+				"grids": {s: _Grid.from_arrays(data, f"d{d}_{s}_grid") for s in SPACES},
+			})
+	
+	@classmethod
+	def load(cls, path):
+		""" Open a saved index; each path is read once per process. """
+		path = os.path.abspath(path)
+		if path not in _INDEX_MEMO:
+			with np.load(path) as data:
+				_INDEX_MEMO[path] = cls({key: data[key] for key in data.files})
+		return _INDEX_MEMO[path]
+	
+	def __len__(self):
+		return sum(len(d["node"]) for d in self.depths)
+	
+	def _node_expr(self, node):
+		parts = []
+		while self.node_parent[node] >= 0:
+			parts.append(f"!{self.percents[self.node_pct[node]]}!{self.names[self.node_partner[node]]}")
+			node = self.node_parent[node]
+		return self.names[self.node_partner[node]] + "".join(reversed(parts))
+	
+	def _point_vecs(self, depth, idx):
+		""" Exact float64 CMYK of points, recomputed from their records. """
+		d = self.depths[depth]
+		vecs = self.node_cmyk[d["node"][idx]]
+		partner = d["partner"][idx]
+		if depth < 2:
+			return vecs
+		ratios = np.array(self.percents, dtype=np.float64)[d["pct"][idx]] / 100.0
+		return _mix_arrays(vecs, self.cmyk[partner], ratios, pairwise=True)
+	
+	def _point_expr(self, depth, i):
+		d = self.depths[depth]
+		expr = self._node_expr(d["node"][i])
+		if depth == 2:
+			expr += f"!{self.percents[d['pct'][i]]}!{self.names[d['partner'][i]]}"
+		return expr
+	
+	def query(self, target_hex, metric='rgb', max_bangs=None, k=None):
+		"""
+		Best expression per depth for target_hex, in the format of solve().
+		
+		The k spatial neighbours in the metric's space are re-ranked with the
+		exact metric. CIEDE2000 departs from Euclidean Lab, so 'lab' looks at
+		more neighbours by default (128, against 8 for 'rgb').
+		"""
+		k = k or (128 if metric == 'lab' else 8)
+		max_bangs = self.max_bangs if max_bangs is None else max_bangs
+		if max_bangs > self.max_bangs:
+			raise ValueError(f"Index was built for n <= {self.max_bangs}, not {max_bangs}")
+		
+		t_rgb = parse_hex(target_hex)
+		space = 'lab' if metric == 'lab' else 'rgb'
+		distance = _distance_kernel(metric, t_rgb)
+		q = _metric_coords(metric, np.array(t_rgb))
+		
+		best_results = {}
+		for depth in range(max_bangs + 1):
+			d = self.depths[depth]
+			idx = d["grids"][space].nearest(d["coords"][space], q, k)
+			vecs = self._point_vecs(depth, idx)
+			rgbs = cmyk_to_rgb_array(vecs)
+			gaps = distance(_metric_coords(metric, rgbs))
+			i = int(np.argmin(gaps))
+			best_results[depth] = _result(gaps[i], vecs[i], self._point_expr(depth, idx[i]), rgbs[i])
+		
+		return t_rgb, best_results
+
+def _depth_arrays(depth, node, partner, pct, rgb):
+	rgb = np.asarray(rgb, dtype=np.float64)
+	arrays = {f"d{depth}_node": node.astype(np.int32), f"d{depth}_partner": partner.astype(np.int16),
+			  f"d{depth}_pct": pct.astype(np.int16)}
+	for space in SPACES:
+		coords = _metric_coords(space, rgb)
+		arrays[f"d{depth}_{space}"] = coords.astype(np.float16)  # only used to shortlist, re-ranked exactly
+		arrays.update(_Grid.build(coords).arrays(f"d{depth}_{space}_grid"))
+	return arrays
+
+def build_index(path, max_bangs=2, step_size=5, palette=None):
+	"""
+	Enumerate every mix up to max_bangs (1 or 2) of the palette at step_size,
+	one per 24-bit simulated RGB value at depth 2, and save it to path (.npz).
+	
+	Returns the loaded MixIndex.
+	"""
+	if max_bangs not in INDEX_DEPTHS:
+		raise ValueError(f"max_bangs must be one of {INDEX_DEPTHS}")
+	tables = MixTables(palette, step_size)
+	names, B, P = tables.names, len(tables.names), len(tables.ratios)
+	arrays = {
+		"names": np.array(names), "cmyk": tables.base_vecs, "percents": np.array(tables.percents, dtype=np.int16),
+		"step_size": np.int64(step_size), "max_bangs": np.int64(max_bangs),
+	}
+	
+	# Depth 0: the bases themselves
+	roots = np.arange(B)
+	none = np.full(B, -1)
+	arrays.update(_depth_arrays(0, roots, none, none, tables.base_rgbs))
+	
+	# Depth 1: tabulated mixes, scan order, minus no-ops and repeated CMYK vectors
+	partners = tables.first_partners
+	allowed = np.broadcast_to(tables.allowed(roots, partners)[:, :, None], tables.first_vecs.shape[:3])
+	c_idx, b_idx, p_idx = np.nonzero(allowed)
+	vecs = tables.first_vecs[c_idx, b_idx, p_idx]
+	_, first = np.unique(vecs, axis=0, return_index=True)
+	first = np.sort(first)
+	c_idx, b_idx, p_idx, vecs = c_idx[first], partners[b_idx[first]], p_idx[first], vecs[first]
+	
+	node_parent = np.concatenate([none, c_idx]).astype(np.int32)
+	node_partner = np.concatenate([roots, b_idx]).astype(np.int16)  # roots store their own base
+	node_pct = np.concatenate([none, p_idx]).astype(np.int16)
+	node_cmyk = np.concatenate([tables.base_vecs, vecs])
+	arrays.update(node_parent=node_parent, node_partner=node_partner, node_pct=node_pct, node_cmyk=node_cmyk)
+	
+	d1_nodes = np.arange(B, len(node_cmyk))
+	none = np.full(len(d1_nodes), -1)
+	arrays.update(_depth_arrays(1, d1_nodes, none, none, cmyk_to_rgb_array(vecs)))
+	
+	# Depth 2: every depth-1 node mixed with every base, streamed in chunks.
+	# Each 24-bit RGB cell keeps the mix closest to its center, so any hex
+	# target whose own cell is reachable gets that cell's best mix.
+	if max_bangs == 2:
+		best_err = np.full(1 << 24, np.inf, dtype=np.float32)
+		best_node = np.full(1 << 24, -1, dtype=np.int32)
+		best_partner = np.zeros(1 << 24, dtype=np.int16)
+		best_pct = np.zeros(1 << 24, dtype=np.int16)
+		bases = np.arange(B)
+		rows = max(1, EVAL_CHUNK_SIZE // (B * P))
+		for start in range(0, len(d1_nodes), rows):
+			nodes = d1_nodes[start:start + rows]
+			mask = np.broadcast_to(tables.allowed(node_partner[nodes], bases)[:, :, None], (len(nodes), B, P))
+			rgb = cmyk_to_rgb_array(_mix_arrays(node_cmyk[nodes], tables.base_vecs, tables.ratios))
+			n_idx, b_idx, p_idx = np.nonzero(mask)
+			rgb = rgb[n_idx, b_idx, p_idx] * 255.0
+			keys = _rgb_keys(rgb / 255.0)
+			err = ((rgb - np.rint(rgb)) ** 2).sum(axis=1).astype(np.float32)
+			order = np.lexsort((err, keys))
+			first = order[np.concatenate([[True], keys[order][1:] != keys[order][:-1]])]
+			first = first[err[first] < best_err[keys[first]]]
+			k = keys[first]
+			best_err[k] = err[first]
+			best_node[k], best_partner[k], best_pct[k] = nodes[n_idx[first]], b_idx[first], p_idx[first]
+		
+		k = np.flatnonzero(best_node >= 0)
+		node, partner, pct = best_node[k], best_partner[k], best_pct[k]
+		vecs = _mix_arrays(node_cmyk[node], tables.base_vecs[partner], tables.ratios[pct], pairwise=True)
+		arrays.update(_depth_arrays(2, node, partner, pct, cmyk_to_rgb_array(vecs)))
+	
+	path = os.path.abspath(path)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	with open(path, "wb") as f:
+		np.savez(f, **arrays)
+	index = _INDEX_MEMO[path] = MixIndex(arrays)
+	return index
@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import threading
+import contextlib
+import socketserver
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .dvips_color_matcher import solve, parse_hex, MixTables, _as_palette
+
+SEARCH_DEFAULTS = {"bangs": 2, "metric": "rgb", "beam": 1000, "step": 5,
+				   "dedup": True, "refine": False, "prune": False, "time_budget": None, "max_evals": None}
+
+class DvipsService:
+	"""
+	Warm dvips matcher: the palette is loaded once, MixTables (with their
+	per-metric coordinates) are kept per step size and results are kept in
+	an LRU cache of cache_size entries. handle() is safe to call from
+	several threads.
+	
+	Requests are dicts with a "hex" and optional "id", "bangs", "metric",
+	"beam", "step", "dedup", "refine", "prune", "time_budget" and
+	"max_evals" (defaults as in SEARCH_DEFAULTS).
+	"""
+	def __init__(self, palette=None, cache_size=1024, defaults=None):
+		with contextlib.redirect_stdout(sys.stderr):
+			self.palette = _as_palette(palette)
+		self.defaults = dict(SEARCH_DEFAULTS, **(defaults or {}))
+		self.cache_size = cache_size
+		self._tables = {}
+		self._results = OrderedDict()
+		self._lock = threading.Lock()
+		self.hits = self.misses = 0
+	
+	def tables(self, step, metric):
+		with self._lock:
+			if step not in self._tables:
+				self._tables[step] = MixTables(self.palette, step)
+			tables = self._tables[step]
+		tables.coords(metric)
+		return tables
+	
+	def match(self, target_hex, **params):
+		""" solve() with the service's defaults, tables and result cache; returns (t_rgb, best_results). """
+		p = dict(self.defaults, **params)
+		if p["metric"] not in ("rgb", "lab"):
+			raise ValueError(f"Unknown metric: {p['metric']}")
+		rgb = parse_hex(target_hex)
+		# Budgeted searches depend on timing, so only complete ones are cached
+		key = (tuple(round(c * 255) for c in rgb),) + tuple(p[name] for name in sorted(SEARCH_DEFAULTS))
+		cacheable = p["time_budget"] is None
+		with self._lock:
+			if cacheable and key in self._results:
+				self._results.move_to_end(key)
+				self.hits += 1
+				return self._results[key]
+			self.misses += 1
+		
+		result = solve(target_hex, p["bangs"], p["metric"], p["beam"], p["step"], palette=self.tables(p["step"], p["metric"]),
+					   dedup=p["dedup"], refine=p["refine"], prune=p["prune"], time_budget=p["time_budget"], max_evals=p["max_evals"])
+		if cacheable:
+			with self._lock:
+				self._results[key] = result
+				while len(self._results) > self.cache_size:
+					self._results.popitem(last=False)
+		return result
+	
+	def handle(self, request):
+		""" Answer one request dict; errors are reported in the response rather than raised. """
+		response = {"id": request.get("id")} if isinstance(request, dict) else {"id": None}
+		try:
+			if not isinstance(request, dict) or "hex" not in request:
+				raise ValueError("Request must be an object with a 'hex' field")
+			params = {name: request[name] for name in SEARCH_DEFAULTS if name in request}
+			t_rgb, res = self.match(request["hex"], **params)
+		except Exception as e:
+			response["error"] = f"{type(e).__name__}: {e}"
+			return response
+		response["hex"] = request["hex"]
+		response["results"] = [{"depth": k, "gap": gap, "expression": expr, "rgb": rgb, "cmyk": cmyk}
+							   for k, (gap, cmyk, expr, rgb) in sorted(res.items())]
+		return response
+	
+	def handle_line(self, line):
+		""" Answer one JSON-lines request; returns the response line, or None for a blank line. """
+		if not line.strip():
+			return None
+		try:
+			request = json.loads(line)
+		except ValueError as e:
+			return json.dumps({"id": None, "error": f"Invalid JSON: {e}"})
+		return json.dumps(self.handle(request))
+
+def serve_stdio(service, workers=4, stdin=None, stdout=None):
+	"""
+	Read JSON-lines requests from stdin and write one response line per
+	request to stdout. Up to `workers` requests are answered concurrently,
+	so responses may come out of order; match them on "id".
+	"""
+	stdin, stdout = stdin or sys.stdin, stdout or sys.stdout
+	write_lock = threading.Lock()
+	
+	def answer(line):
+		out = service.handle_line(line)
+		if out is not None:
+			with write_lock:
+				stdout.write(out + "\n")
+				stdout.flush()
+	
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		for line in stdin:
+			pool.submit(answer, line)
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		for line in self.rfile:
+			out = self.server.service.handle_line(line.decode("utf-8"))
+			if out is not None:
+				self.wfile.write(out.encode("utf-8") + b"\n")
+				self.wfile.flush()
+
+if hasattr(socketserver, "UnixStreamServer"):
+	class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+		daemon_threads = True
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+def serve_socket(service, path=None, port=None, host="127.0.0.1"):
+	"""
+	Serve JSON-lines requests on a Unix socket at path (or TCP host:port),
+	one thread per connection. Each connection is answered in order.
+	Blocks until interrupted.
+	"""
+	if path is not None:
+		if os.path.exists(path):
+			os.unlink(path)
+		server = _ThreadingUnixServer(path, _RequestHandler)
+	else:
+		server = _ThreadingTCPServer((host, port), _RequestHandler)
+	server.service = service
+	try:
+		server.serve_forever()
+	finally:
+		server.server_close()
+		if path is not None and os.path.exists(path):
+			os.unlink(path)
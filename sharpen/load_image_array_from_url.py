@@ -1,10 +1,155 @@
+import os
+import time
+import hashlib
+import threading
+import http.client
 import urllib.request
+import urllib.error
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 
-def img_from_url(url):
-	response = urllib.request.urlopen(url)
-	image_data = response.read()
+from .cache import cache_dir as _cache_dir
+
+def _decode(image_data):
+	""" Encoded image bytes as an RGB uint8 array. """
 	np_array = np.frombuffer(image_data, np.uint8)
 	image_bgr = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
+	if image_bgr is None:
+		raise ValueError("Could not decode image data")
 	return image_bgr[:, :, ::-1].copy()
+
+def img_from_url(url):
+	response = urllib.request.urlopen(url)
+	image_data = response.read()
+	return _decode(image_data)
+
+def _url_cache_path(url, cache_dir=None):
+	root = cache_dir or _cache_dir("urls")
+	digest = hashlib.sha256(url.encode()).hexdigest()
+	return os.path.join(root, digest[:2], digest)
+
+class _ConnectionPool:
+	"""
+	Keep-alive HTTP(S) connections, one per (scheme, host, port) per thread,
+	so each worker reuses its connection instead of handshaking per image.
+	"""
+	def __init__(self, timeout=30):
+		self.timeout = timeout
+		self._local = threading.local()
+		self._all = []
+		self._lock = threading.Lock()
+	
+	def _connection(self, scheme, netloc):
+		conns = self._local.__dict__.setdefault("conns", {})
+		key = (scheme, netloc)
+		if key not in conns:
+			cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+			conns[key] = cls(netloc, timeout=self.timeout)
+			with self._lock:
+				self._all.append(conns[key])
+		return conns[key]
+	
+	def get(self, url, max_redirects=5):
+		""" The body of url, following redirects; raises urllib.error.HTTPError on HTTP errors. """
+		for _ in range(max_redirects + 1):
+			parts = urllib.parse.urlsplit(url)
+			if parts.scheme not in ("http", "https"):
+				with urllib.request.urlopen(url, timeout=self.timeout) as response:
+					return response.read()
+			conn = self._connection(parts.scheme, parts.netloc)
+			path = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+			try:
+				conn.request("GET", path, headers={"User-Agent": "sharpen", "Connection": "keep-alive"})
+				response = conn.getresponse()
+				body = response.read()
+			except (http.client.HTTPException, OSError):
+				# The server may have dropped an idle connection; start a fresh one next time
+				conn.close()
+				raise
+			if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+				url = urllib.parse.urljoin(url, response.getheader("Location"))
+				continue
+			if response.status != 200:
+				raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+			return body
+		raise OSError(f"Too many redirects for {url}")
+	
+	def close(self):
+		with self._lock:
+			for conn in self._all:
+				conn.close()
+			self._all.clear()
+
+def _fetch(url, pool, cache, cache_dir, retries):
+	"""
+	Decoded image at url, from the disk cache if there, else downloaded
+	(with retries). Only bytes that decode are cached, so an error page
+	served with a 200 is not kept.
+	"""
+	path = _url_cache_path(url, cache_dir) if cache else None
+	if path and os.path.exists(path):
+		with open(path, "rb") as f:
+			return _decode(f.read())
+	
+	for attempt in range(retries + 1):
+		try:
+			data = pool.get(url)
+			break
+		except (http.client.HTTPException, OSError) as e:
+			# Client errors (404 and the like) will not go away on a retry
+			if attempt == retries or (isinstance(e, urllib.error.HTTPError) and e.code < 500):
+				raise
+			time.sleep(0.5 * 2 ** attempt)
+	
+	image = _decode(data)
+	if path:
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+		with open(tmp, "wb") as f:
+			f.write(data)
+		os.replace(tmp, path)
+	return image
+
+def imgs_from_urls(urls, num_workers=16, cache=True, cache_dir=None, timeout=30, retries=2, errors="raise"):
+	"""
+	Lazily yield img_from_url(url) for each url, in input order. Up to
+	num_workers downloads (and their decodes) run at once in a thread pool
+	over keep-alive connections, with at most 4 * num_workers images in
+	flight. Downloads are cached by URL under cache_dir (default
+	$SHARPEN_CACHE/urls), so later runs skip the network. Failed requests
+	are retried with backoff; with errors="skip" an image that still fails
+	is yielded as None, with a warning.
+	"""
+	if errors not in ("raise", "skip"):
+		raise ValueError(f"Invalid errors: {errors}")
+	pool = _ConnectionPool(timeout)
+	
+	def load(url):
+		try:
+			return _fetch(url, pool, cache, cache_dir, retries)
+		except Exception as e:
+			if errors == "raise":
+				raise
+			print(f"Warning: skipping {url} ({type(e).__name__}: {e})")
+			return None
+	
+	pending = deque()
+	try:
+		with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+			try:
+				for url in urls:
+					pending.append(executor.submit(load, url))
+					if len(pending) >= 4 * max(1, num_workers):
+						yield pending.popleft().result()
+				while pending:
+					yield pending.popleft().result()
+			finally:
+				# Closed early or failed: drop the queued downloads
+				for future in pending:
+					future.cancel()
+	finally:
+		# Once the executor has shut down, so no worker still holds a connection
+		pool.close()
@@ -1,10 +1,22 @@
+import io
 import os
 import re
+import json
+import hashlib
 import torch
 import numpy as np
-import pandas as pd
+import fsspec
+import pyarrow.parquet as pq
+from functools import partial
+from collections import deque
+from itertools import islice, zip_longest
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from PIL import Image as PILImage
-from datasets import Dataset, Features, Image, ClassLabel, load_dataset, DownloadConfig
+from datasets import Dataset, Features, Image, ClassLabel, load_dataset_builder, DownloadConfig
+from datasets import config as datasets_config
+from huggingface_hub import HfApi, CommitOperationAdd, CommitOperationDelete, DatasetCard, hf_hub_download
+
+from .cache import cache_dir
 
 DEFAULT_CLASS_NAMES = {
 	"cifar10": [
@@ -18,19 +30,124 @@ DEFAULT_CLASS_NAMES = {
 	]
 }
 
+PLACEHOLDER_CLASS_NAMES = [str(i) for i in range(100)]
+_CLASS_NAMES_MEMO = {}
+
+def _class_names_cache_path(source):
+	return cache_dir("class-names", hashlib.sha1(source.encode()).hexdigest()[:16] + ".json")
+
+def _read_class_names_file(path):
+	""" Names from a .json list (or {"names": [...]}) or a .txt file with one name per line. """
+	with open(path) as f:
+		if path.endswith(".json"):
+			names = json.load(f)
+			return list(names["names"] if isinstance(names, dict) else names)
+		return [line.strip() for line in f if line.strip()]
+
+def _hub_class_names(source, column="label"):
+	""" ClassLabel names from the dataset's builder info, without downloading its data. """
+	builder = load_dataset_builder(source, download_config=DownloadConfig(max_retries=0))
+	features = builder.info.features
+	if features is None or not isinstance(features.get(column), ClassLabel):
+		raise ValueError(f"{source} has no ClassLabel column '{column}' in its metadata")
+	return list(features[column].names)
+
 def get_class_names(source: str = "tinyimagenet") -> list:
-	try:
-		ds = load_dataset(source, split='train', download_config=DownloadConfig(max_retries=0))
-		names = ds.features['label'].names
-		if isinstance(names, list) and len(names) > 1:
-			return names
-	except Exception:
-		return DEFAULT_CLASS_NAMES.get(source.lower(), [str(i) for i in range(100)])
-
-def preprocess_image_array(images):
+	"""
+	Class names from a list, a built-in set ('cifar10', 'cifar100',
+	'tinyimagenet'), a local .json/.txt file or a hub dataset's metadata.
+	Hub lookups are cached in process and on disk (under $SHARPEN_CACHE,
+	default ~/.cache/sharpen), so later runs work offline. An empty source
+	gives 100 placeholder names; so does, with a warning, an unresolvable one.
+	"""
+	if isinstance(source, (list, tuple)):
+		return list(source)
+	if not source:
+		return list(PLACEHOLDER_CLASS_NAMES)
+	if source in _CLASS_NAMES_MEMO:
+		return _CLASS_NAMES_MEMO[source]
+	
+	if source.lower() in DEFAULT_CLASS_NAMES:
+		names = DEFAULT_CLASS_NAMES[source.lower()]
+	elif os.path.isfile(source):
+		names = _read_class_names_file(source)
+	else:
+		cache_path = _class_names_cache_path(source)
+		try:
+			with open(cache_path) as f:
+				names = json.load(f)
+		except (OSError, ValueError):
+			try:
+				names = _hub_class_names(source)
+			except Exception as e:
+				print(f" -> Could not resolve class names from '{source}' ({e}); using 100 placeholder names.")
+				return list(PLACEHOLDER_CLASS_NAMES)
+			os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+			with open(cache_path, "w") as f:
+				json.dump(names, f)
+	
+	_CLASS_NAMES_MEMO[source] = names
+	return names
+
+def map_ordered(fn, items, num_workers=None, worker_type="thread"):
+	"""
+	Lazily yield fn(item) for each item, in input order. With num_workers > 1
+	the calls run in a thread (or, with worker_type="process", a process)
+	pool, keeping at most 4 * num_workers items in flight.
+	"""
+	if not num_workers or num_workers <= 1:
+		yield from map(fn, items)
+		return
+	if worker_type not in ("thread", "process"):
+		raise ValueError(f"Invalid worker_type: {worker_type}")
+	
+	executor = ThreadPoolExecutor if worker_type == "thread" else ProcessPoolExecutor
+	with executor(max_workers=num_workers) as pool:
+		pending = deque()
+		for item in items:
+			pending.append(pool.submit(fn, item))
+			if len(pending) >= 4 * num_workers:
+				yield pending.popleft().result()
+		while pending:
+			yield pending.popleft().result()
+
+def _read_image(path, passthrough=False, image_mode=None, image_size=None):
+	"""
+	The image file at path: with passthrough and no normalization asked,
+	its original bytes as an Image() feature dict; else decoded, converted
+	to image_mode (default RGB) and resized to image_size (width, height).
+	"""
+	if passthrough and image_mode is None and image_size is None:
+		with open(path, 'rb') as f:
+			return {"bytes": f.read(), "path": os.path.basename(path)}
+	with PILImage.open(path) as img:
+		img = img.convert(image_mode or 'RGB')
+	return img if image_size is None else img.resize(tuple(image_size))
+
+def _array_to_image(img):
+	return PILImage.fromarray(img[..., 0] if img.shape[-1] == 1 else img)
+
+def _chunk_to_numpy(chunk):
+	if isinstance(chunk, torch.Tensor):
+		chunk = chunk.cpu()
+		return (chunk.float() if chunk.dtype == torch.bfloat16 else chunk).numpy()
+	return chunk
+
+def iter_image_array_chunks(images, chunk_size=256, scale=None):
+	"""
+	Yield contiguous uint8 NHWC chunks of up to chunk_size images from an
+	image tensor or array (NCHW or NHWC, or a single 2D/3D image).
+	uint8 input passes through as is. Other dtypes are multiplied by 255 if
+	scale (by default: if the max, found in one pass, is <= 1), clipped and
+	cast chunk by chunk, so there is never a full-size temporary; tensors
+	are moved to the CPU one chunk at a time.
+	"""
 	if isinstance(images, torch.Tensor):
-		images = images.detach().cpu().float().numpy()
-	elif not isinstance(images, np.ndarray):
+		images = images.detach()
+		is_uint8 = images.dtype == torch.uint8
+	elif isinstance(images, np.ndarray):
+		is_uint8 = images.dtype == np.uint8
+	else:
 		raise ValueError("Expected torch.Tensor or np.ndarray")
 	
 	if images.ndim == 2:
@@ -41,52 +158,427 @@ def preprocess_image_array(images):
 		raise ValueError("Expected 4D image array")
 	
 	if images.shape[1] in [1, 3] and images.shape[1] != images.shape[2]:
-		images = np.transpose(images, (0, 2, 3, 1))
+		images = images.permute(0, 2, 3, 1) if isinstance(images, torch.Tensor) else np.transpose(images, (0, 2, 3, 1))
 	
-	if images.max() <= 1.0:
-		images = (images * 255).clip(0, 255)
+	if not is_uint8 and scale is None:
+		scale = float(images.max()) <= 1.0
 	
-	return [PILImage.fromarray(img.astype(np.uint8)) for img in images]
+	scratch = None
+	for start in range(0, images.shape[0], chunk_size):
+		chunk = _chunk_to_numpy(images[start:start + chunk_size])
+		if is_uint8:
+			yield np.ascontiguousarray(chunk)
+			continue
+		
+		if scratch is None or scratch.shape != chunk.shape:
+			dtype = chunk.dtype if np.issubdtype(chunk.dtype, np.floating) else np.float64
+			scratch = np.empty(chunk.shape, dtype=dtype)
+		np.multiply(chunk, 255 if scale else 1, out=scratch, casting='unsafe')
+		np.clip(scratch, 0, 255, out=scratch)
+		# A fresh buffer per chunk: PIL images may keep views into it
+		out = np.empty(chunk.shape, dtype=np.uint8)
+		np.copyto(out, scratch, casting='unsafe')
+		yield out
+
+def iter_image_array(images, chunk_size=256, scale=None):
+	""" The single HWC uint8 images of iter_image_array_chunks(). """
+	for chunk in iter_image_array_chunks(images, chunk_size, scale):
+		yield from chunk
+
+def preprocess_image_array(images, num_workers=None, worker_type="thread", chunk_size=256, scale=None):
+	return list(map_ordered(_array_to_image, iter_image_array(images, chunk_size, scale), num_workers, worker_type))
 
-def load_images(X, image_sort_mode):
+def _list_image(x):
+	return PILImage.fromarray(x) if isinstance(x, np.ndarray) else x
+
+def _array_fingerprint(img):
+	return str(img.shape).encode() + img.tobytes()
+
+def _list_fingerprint(x):
+	if isinstance(x, np.ndarray):
+		return _array_fingerprint(x)
+	if isinstance(x, PILImage.Image):
+		return f"{x.mode}{x.size}".encode() + x.tobytes()
+	if isinstance(x, dict):
+		return x.get("bytes") or str(x.get("path")).encode()
+	return repr(x).encode()
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+def _scan_cache_path(folder):
+	return cache_dir("scans", hashlib.sha1(os.path.abspath(folder).encode()).hexdigest()[:16] + ".json")
+
+def scan_image_folder(folder, recursive=False, cache=False):
+	"""
+	[(relative path, size, mtime_ns)] of the image files in folder (and its
+	subfolders if recursive), unsorted, from os.scandir's stat results.
+	With cache, the listing is kept under $SHARPEN_CACHE/scans and later
+	scans only list directories whose mtime changed; a file rewritten in
+	place, which leaves its directory's mtime alone, keeps its old stats.
+	"""
+	cached = {}
+	if cache:
+		try:
+			with open(_scan_cache_path(folder)) as f:
+				cached = json.load(f)
+		except (OSError, ValueError):
+			pass
+	
+	dirs = {}
+	changed = False
+	stack = [""]
+	while stack:
+		rel = stack.pop()
+		path = os.path.join(folder, rel)
+		mtime = os.stat(path).st_mtime_ns
+		entry = cached.get(rel)
+		if entry is None or entry["mtime"] != mtime:
+			files, subdirs = [], []
+			with os.scandir(path) as it:
+				for e in it:
+					if e.is_dir():
+						subdirs.append(e.name)
+					elif e.name.lower().endswith(IMAGE_EXTENSIONS) and e.is_file():
+						st = e.stat()
+						files.append((e.name, st.st_size, st.st_mtime_ns))
+			entry = {"mtime": mtime, "files": files, "subdirs": subdirs}
+			changed = True
+		dirs[rel] = entry
+		if recursive:
+			stack.extend(os.path.join(rel, d) for d in entry["subdirs"])
+	
+	if cache and (changed or (recursive and len(dirs) != len(cached))):
+		os.makedirs(os.path.dirname(_scan_cache_path(folder)), exist_ok=True)
+		with open(_scan_cache_path(folder), "w") as f:
+			# A full recursive walk drops directories that are gone
+			json.dump(dirs if recursive else dict(cached, **dirs), f)
+	return [(os.path.join(rel, name), size, mtime) for rel, entry in dirs.items() for name, size, mtime in entry["files"]]
+
+def folder_labels(folder, image_paths, class_names=None):
+	"""
+	ImageFolder-style labels for image_paths under folder: each file's class
+	is its top-level subfolder. Returns (labels, class names); the names are
+	the sorted subfolder names unless class_names gives their order.
+	"""
+	if not (isinstance(folder, str) and os.path.isdir(folder)):
+		raise ValueError("Labels can only be inferred for an image folder")
+	classes = [os.path.relpath(p, folder).split(os.sep)[0] for p in image_paths]
+	if any(c == os.path.relpath(p, folder) for c, p in zip(classes, image_paths)):
+		raise ValueError(f"Cannot infer labels: {folder} has images outside class subfolders")
+	names = list(class_names) if class_names else sorted(set(classes))
+	index = {name: i for i, name in enumerate(names)}
+	unknown = sorted(set(classes) - set(index))
+	if unknown:
+		raise ValueError(f"Subfolders not among the class names: {unknown[:5]}")
+	return np.array([index[c] for c in classes], dtype=np.int64), names
+
+def image_source(X, image_sort_mode="natural", passthrough=False, image_mode=None, image_size=None,
+				 recursive=False, scan_cache=False):
+	"""
+	(items, read, fingerprint) for an image input: its raw items (file
+	paths, uint8 HWC arrays or list entries, lazily where possible), a
+	picklable function turning one item into an image and one giving a
+	cheap content key of an item (relative path, size and mtime for files,
+	from the scan's stat results). Folders are scanned with
+	scan_image_folder() and sorted on relative paths.
+	"""
 	if isinstance(X, str) and os.path.isdir(X):
-		image_paths = [
-			os.path.join(X, f) for f in os.listdir(X)
-			if f.lower().endswith(('.png', '.jpg', '.jpeg'))
-		]
+		entries = scan_image_folder(X, recursive, scan_cache)
 	
 		if image_sort_mode == "natural":
 			def natural_key(f): return [int(t) if t.isdigit() else t.lower() for t in re.split(r'(\d+)', f)]
-			image_paths.sort(key=lambda x: natural_key(os.path.basename(x)))
+			entries.sort(key=lambda e: natural_key(e[0]))
 		elif image_sort_mode == "plain":
-			image_paths.sort()
+			entries.sort()
 		elif image_sort_mode == "mtime":
-			image_paths.sort(key=lambda x: os.path.getmtime(x))
+			entries.sort(key=lambda e: e[2])
 		elif image_sort_mode == "none":
 			pass
 		elif callable(image_sort_mode):
-			image_paths.sort(key=image_sort_mode)
+			entries.sort(key=lambda e: image_sort_mode(os.path.join(X, e[0])))
 		else:
 			raise ValueError(f"Invalid image_sort_mode: {image_sort_mode}")
+		image_paths = [os.path.join(X, rel) for rel, _, _ in entries]
+		stats = {path: f"{rel}:{size}:{mtime}".encode() for path, (rel, size, mtime) in zip(image_paths, entries)}
 	
-		return [PILImage.open(p).convert('RGB') for p in image_paths]
+		read = partial(_read_image, passthrough=passthrough, image_mode=image_mode, image_size=image_size)
+		return image_paths, read, stats.__getitem__
 	
 	elif isinstance(X, (torch.Tensor, np.ndarray)):
-		return preprocess_image_array(X)
+		return iter_image_array(X), _array_to_image, _array_fingerprint
 	
 	elif isinstance(X, list):
-		return [PILImage.fromarray(x) if isinstance(x, np.ndarray) else x for x in X]
+		return X, _list_image, _list_fingerprint
 	
 	else:
 		raise ValueError("Unsupported image input type.")
 
-def load_labels(label_source):
-	if isinstance(label_source, list):
-		return label_source
+def iter_images(X, image_sort_mode="natural", num_workers=None, worker_type="thread",
+				passthrough=False, image_mode=None, image_size=None, recursive=False, scan_cache=False):
+	"""
+	Like load_images(), but yields the images one at a time; folders are
+	read lazily. Decoding and conversion run on num_workers workers (see
+	map_ordered), keeping the input order. With passthrough, folder images
+	keep their original encoded bytes unless image_mode or image_size asks
+	for a normalization (see _read_image).
+	"""
+	items, read, _ = image_source(X, image_sort_mode, passthrough, image_mode, image_size, recursive, scan_cache)
+	yield from map_ordered(read, items, num_workers, worker_type)
+
+def load_images(X, image_sort_mode, num_workers=None, worker_type="thread",
+				passthrough=False, image_mode=None, image_size=None, recursive=False, scan_cache=False):
+	return list(iter_images(X, image_sort_mode, num_workers, worker_type, passthrough, image_mode, image_size,
+							recursive, scan_cache))
+
+def _open_parquet(path):
+	f = fsspec.open(path, "rb").open()
+	return f, pq.ParquetFile(f)
+
+def _txt_labels(path):
+	""" Integer labels of a .txt file, one per line; blank lines are skipped. """
+	with open(path) as f:
+		for line in f:
+			if line.strip():
+				yield int(line)
+
+def load_labels(label_source, column="label"):
+	"""
+	Labels as an integer array from a list/array, a .txt file (one per line)
+	or a .parquet path or URL (e.g. hf://...), reading only that column.
+	"""
+	if isinstance(label_source, (list, tuple, np.ndarray)):
+		return np.asarray(label_source, dtype=np.int64)
+	elif isinstance(label_source, str) and label_source.endswith(".txt"):
+		return np.fromiter(_txt_labels(label_source), dtype=np.int64)
 	elif isinstance(label_source, str) and label_source.endswith(".parquet"):
-		return pd.read_parquet(label_source)['label'].tolist()
+		f, pf = _open_parquet(label_source)
+		with f:
+			return pf.read(columns=[column]).column(0).to_numpy()
 	else:
-		raise ValueError("label_source must be a list or .parquet path")
+		raise ValueError("label_source must be a list, .txt or .parquet path")
+
+def iter_labels(label_source, column="label"):
+	""" load_labels(), streamed: a .parquet source is read one row group at a time, a .txt one line at a time. """
+	if isinstance(label_source, str) and label_source.endswith(".txt"):
+		yield from _txt_labels(label_source)
+	elif isinstance(label_source, str) and label_source.endswith(".parquet"):
+		f, pf = _open_parquet(label_source)
+		with f:
+			for i in range(pf.num_row_groups):
+				yield from pf.read_row_group(i, columns=[column]).column(0).to_numpy()
+	elif isinstance(label_source, str):
+		raise ValueError("label_source must be a list, .txt or .parquet path")
+	else:
+		yield from label_source
+
+MANIFEST_NAME = "sharpen-manifest.json"
+
+def _batches(items, labels, shard_size):
+	""" Lists of shard_size (item, label) pairs; raises on a length mismatch. """
+	missing = object()
+	pairs = zip_longest(items, labels, fillvalue=missing)
+	count = 0
+	while True:
+		batch = list(islice(pairs, shard_size))
+		if not batch:
+			return
+		if any(item is missing or label is missing for item, label in batch):
+			n_images = count + sum(item is not missing for item, _ in batch)
+			n_labels = count + sum(label is not missing for _, label in batch)
+			raise ValueError(f"Mismatch: {n_images} images vs {n_labels} labels read before one input ran out")
+		count += len(batch)
+		yield batch
+
+def _read_options(read):
+	""" Name and bound options of an image_source() read function, e.g. _read_image(image_mode='L'). """
+	if isinstance(read, partial):
+		options = sorted({**dict(enumerate(read.args)), **read.keywords}.items(), key=lambda kv: str(kv[0]))
+		return f"{read.func.__module__}.{read.func.__qualname__}{options}"
+	return f"{read.__module__}.{read.__qualname__}"
+
+def _shard_key(features, read, fingerprints, labels):
+	h = hashlib.sha256(json.dumps(features.to_dict(), sort_keys=True).encode())
+	h.update(_read_options(read).encode())
+	for fingerprint, label in zip(fingerprints, labels):
+		h.update(hashlib.sha256(fingerprint).digest())
+		h.update(f"{label};".encode())
+	return h.hexdigest()
+
+def _encode_shard(images, labels, features):
+	shard = Dataset.from_dict({
+		"image": images,
+		"label": labels
+	}, features=features)
+	buf = io.BytesIO()
+	pq.write_table(shard.data.table, buf)
+	return buf.getvalue()
+
+def _updated_card(card, config_name, data_dir, split):
+	""" card (a DatasetCard, or None for a new one) with config_name pointing at data_dir's parquet shards. """
+	card = card or DatasetCard("")
+	configs = [c for c in card.data.get("configs") or [] if c.get("config_name") != config_name]
+	configs.append({"config_name": config_name, "data_files": [{"split": split, "path": f"{data_dir}/{split}-*"}]})
+	card.data["configs"] = configs
+	return card
+
+class ShardSink:
+	"""
+	Target of write_shards(): parquet shards under {data_dir}/{split}-NNNNN.parquet
+	(data_dir is the config name, or "data" for "default") next to a
+	manifest of each shard's content key, so unchanged shards are skipped.
+	"""
+	def __init__(self, config_name, split="train"):
+		self.config_name, self.split = config_name, split
+		self.data_dir = config_name if config_name != "default" else "data"
+		self.manifest = self._load_manifest()
+	
+	def name(self, index):
+		return f"{self.data_dir}/{self.split}-{index:05d}.parquet"
+	
+	def has(self, index, key):
+		return self.manifest.get(self.name(index)) == key and self._exists(self.name(index))
+	
+	def stale(self, names, num_shards):
+		""" Shard files among names not among the first num_shards. """
+		keep = {self.name(i) for i in range(num_shards)}
+		return [n for n in names if n.startswith(f"{self.data_dir}/{self.split}-") and n.endswith(".parquet") and n not in keep]
+
+class LocalShardSink(ShardSink):
+	""" Shards, manifest and a dataset card written under local_dir, loadable with load_dataset(local_dir, config_name). """
+	def __init__(self, local_dir, config_name, split="train"):
+		self.root = local_dir
+		super().__init__(config_name, split)
+		os.makedirs(os.path.join(local_dir, self.data_dir), exist_ok=True)
+	
+	def _path(self, name):
+		return os.path.join(self.root, *name.split("/"))
+	
+	def _write(self, name, data):
+		path = self._path(name)
+		with open(path + ".tmp", "wb") as f:
+			f.write(data)
+		os.replace(path + ".tmp", path)
+	
+	def _load_manifest(self):
+		try:
+			with open(self._path(f"{self.data_dir}/{MANIFEST_NAME}")) as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return {}
+	
+	def _exists(self, name):
+		return os.path.exists(self._path(name))
+	
+	def put(self, index, key, data):
+		self._write(self.name(index), data)
+		self.manifest[self.name(index)] = key
+		self._write(f"{self.data_dir}/{MANIFEST_NAME}", json.dumps(self.manifest, indent=1).encode())
+	
+	def close(self, num_shards):
+		names = [f"{self.data_dir}/{f}" for f in os.listdir(self._path(self.data_dir))]
+		for name in self.stale(names, num_shards):
+			os.remove(self._path(name))
+			self.manifest.pop(name, None)
+		self._write(f"{self.data_dir}/{MANIFEST_NAME}", json.dumps(self.manifest, indent=1).encode())
+		
+		readme = self._path("README.md")
+		card = _updated_card(DatasetCard.load(readme) if os.path.exists(readme) else None, self.config_name, self.data_dir, self.split)
+		self._write("README.md", str(card).encode())
+
+class HubShardSink(ShardSink):
+	"""
+	Shards preuploaded to a hub dataset repo as they are written (freeing
+	their bytes) and committed, together with the manifest, every
+	commit_every shards, so an interrupted push resumes from its last commit.
+	"""
+	def __init__(self, repo, token, config_name, private=False, split="train", commit_every=50):
+		self.api = HfApi(token=token)
+		self.repo_id = self.api.create_repo(repo, repo_type="dataset", private=private, exist_ok=True).repo_id
+		self.files = set(self.api.list_repo_files(self.repo_id, repo_type="dataset"))
+		self.commit_every = commit_every
+		self.pending = []
+		super().__init__(config_name, split)
+	
+	def _load_manifest(self):
+		if f"{self.data_dir}/{MANIFEST_NAME}" not in self.files:
+			return {}
+		path = hf_hub_download(self.repo_id, f"{self.data_dir}/{MANIFEST_NAME}", repo_type="dataset", token=self.api.token)
+		with open(path) as f:
+			return json.load(f)
+	
+	def _exists(self, name):
+		return name in self.files
+	
+	def _commit(self, operations=()):
+		manifest = CommitOperationAdd(path_in_repo=f"{self.data_dir}/{MANIFEST_NAME}",
+									  path_or_fileobj=json.dumps(self.manifest, indent=1).encode())
+		operations = self.pending + list(operations) + [manifest]
+		step = datasets_config.UPLOADS_MAX_NUMBER_PER_COMMIT
+		for start in range(0, len(operations), step):
+			self.api.create_commit(self.repo_id, operations=operations[start:start + step], repo_type="dataset",
+								   commit_message=f"Upload {self.config_name} shards")
+		self.files.update(a.path_in_repo for a in self.pending)
+		self.pending = []
+	
+	def put(self, index, key, data):
+		addition = CommitOperationAdd(path_in_repo=self.name(index), path_or_fileobj=data)
+		self.api.preupload_lfs_files(self.repo_id, [addition], repo_type="dataset")
+		self.pending.append(addition)
+		self.manifest[self.name(index)] = key
+		if len(self.pending) >= self.commit_every:
+			self._commit()
+	
+	def close(self, num_shards):
+		stale = self.stale(self.files, num_shards)
+		for name in stale:
+			self.manifest.pop(name, None)
+		try:
+			card = DatasetCard.load(self.repo_id, repo_type="dataset", token=self.api.token)
+		except Exception:
+			card = None
+		card = _updated_card(card, self.config_name, self.data_dir, self.split)
+		self._commit([CommitOperationDelete(path_in_repo=name) for name in stale] +
+					 [CommitOperationAdd(path_in_repo="README.md", path_or_fileobj=str(card).encode())])
+		self.files.difference_update(stale)
+
+def write_shards(source, labels, features, sink, shard_size=1000, num_workers=None, worker_type="thread"):
+	"""
+	Write (image, label) pairs as parquet shards of shard_size rows to a
+	ShardSink, one shard in memory at a time. source is image_source()'s
+	(items, read, fingerprint). Shards whose content key (features, read
+	options, item fingerprints and labels) matches the sink's manifest are
+	neither decoded nor rewritten. The items of all other shards go through
+	one map_ordered(), so workers stay busy across shard boundaries.
+	Returns (shards written, shards skipped).
+	"""
+	items, read, fingerprint = source
+	written = skipped = 0
+	changed = deque()  # (index, key, labels) of shards whose images are being read
+	
+	def changed_items():
+		nonlocal skipped
+		for index, batch in enumerate(_batches(items, labels, shard_size)):
+			shard_items = [item for item, _ in batch]
+			shard_labels = [label for _, label in batch]
+			key = _shard_key(features, read, map(fingerprint, shard_items), shard_labels)
+			if sink.has(index, key):
+				skipped += 1
+				continue
+			changed.append((index, key, shard_labels))
+			yield from shard_items
+	
+	images = []
+	for image in map_ordered(read, changed_items(), num_workers, worker_type):
+		images.append(image)
+		index, key, shard_labels = changed[0]
+		if len(images) == len(shard_labels):
+			changed.popleft()
+			sink.put(index, key, _encode_shard(images, shard_labels, features))
+			images = []
+			written += 1
+			print(f" -> Wrote shard {index} ({len(shard_labels)} rows)")
+	sink.close(written + skipped)
+	return written, skipped
 
 def push_images(	
 	images,
@@ -96,10 +588,58 @@ def push_images(
 	labels,
 	class_names='',
 	private=False,
-	image_sort_mode="natural"
+	image_sort_mode="natural",
+	streaming=False,
+	shard_size=1000,
+	num_workers=None,
+	worker_type="thread",
+	passthrough=False,
+	image_mode=None,
+	image_size=None,
+	local_dir=None,
+	label_column="label",
+	recursive=False,
+	infer_labels=False,
+	scan_cache=False
 ):
-	images = load_images(images, image_sort_mode=image_sort_mode)
-	labels = load_labels(labels)
+	"""
+	Push images and labels to the hub as an image classification dataset.
+	With streaming, images and labels (any iterables) are consumed lazily
+	and written as parquet shards of shard_size rows while they are read,
+	so memory stays flat regardless of dataset size. A content manifest
+	kept with the shards makes reruns skip shards whose inputs did not
+	change. With local_dir, the same layout is written there instead of
+	to the hub (repo and token are then unused). num_workers threads
+	(or processes, with worker_type="process") decode and convert images.
+	With passthrough, a folder's PNG/JPEG files are stored with their
+	original bytes; they are only decoded if image_mode or image_size
+	(width, height) asks for a normalization. labels is a list or array,
+	or a .txt/.parquet path of which only label_column is read (row group
+	by row group with streaming). Folders are scanned recursively with
+	recursive, and with infer_labels labels come from each image's class
+	subfolder (ImageFolder layout; class_names, if given, sets the order).
+	With scan_cache, folder listings are cached between runs.
+	"""
+	source = image_source(images, image_sort_mode, passthrough, image_mode, image_size,
+						  recursive or infer_labels, scan_cache)
+	if infer_labels:
+		labels, class_names = folder_labels(images, source[0], get_class_names(class_names) if class_names else None)
+	
+	if streaming or local_dir:
+		class_names = get_class_names(source=class_names)
+		features = Features({
+			"image": Image(),
+			"label": ClassLabel(names=class_names)
+		})
+		labels = iter_labels(labels, label_column)
+		sink = LocalShardSink(local_dir, config_name) if local_dir else HubShardSink(repo, token, config_name, private=private)
+		written, skipped = write_shards(source, labels, features, sink, shard_size, num_workers, worker_type)
+		print(f" -> {written} shards written, {skipped} unchanged")
+		return
+	
+	items, read, _ = source
+	images = list(map_ordered(read, items, num_workers, worker_type))
+	labels = load_labels(labels, label_column)
 	
 	if len(images) != len(labels):
 		raise ValueError(f"Mismatch: {len(images)} images vs {len(labels)} labels")
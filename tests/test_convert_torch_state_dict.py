@@ -0,0 +1,153 @@
+import os
+import json
+import struct
+import itertools
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+
+from sharpen.convert_torch_state_dict import (
+	_linear_assignment, _match_keys, enhanced_robust_map, stream_convert,
+	_write_safetensors, _TensorReader, _SAFETENSORS_DTYPES
+)
+
+@pytest.mark.parametrize("shape", [(3, 3), (4, 6), (6, 4), (5, 5), (1, 4)])
+def test_linear_assignment_matches_brute_force(shape):
+	rng = np.random.default_rng(0)
+	n, m = shape
+	for _ in range(30):
+		cost = rng.integers(0, 10, shape).astype(np.float64)
+		rows, cols = _linear_assignment(cost)
+		assert len(rows) == min(n, m) and len(set(rows)) == len(rows) and len(set(cols)) == len(cols)
+		if n <= m:
+			best = min(sum(cost[i, p[i]] for i in range(n)) for p in itertools.permutations(range(m), n))
+		else:
+			best = min(sum(cost[p[j], j] for j in range(m)) for p in itertools.permutations(range(n), m))
+		assert cost[rows, cols].sum() == pytest.approx(best)
+
+class Encoder(nn.Module):
+	def __init__(self, d):
+		super().__init__()
+		self.fc1 = nn.Linear(d, d)
+		self.norm = nn.LayerNorm(d)
+		self.fc2 = nn.Linear(d, d)
+
+class Model(nn.Module):
+	def __init__(self, d):
+		super().__init__()
+		self.encoder = Encoder(d)
+
+@pytest.mark.parametrize("d", [4, 16])
+def test_renamed_modules_map_in_order(d):
+	# Linear biases and LayerNorm parameters share a shape, and their names barely match
+	saved = {f"enc.{k}": v for k, v in nn.Sequential(nn.Linear(d, d), nn.LayerNorm(d), nn.Linear(d, d)).state_dict().items()}
+	model = Model(d)
+	mapping = _match_keys({k: v.shape for k, v in saved.items()}, {k: v.shape for k, v in model.state_dict().items()})
+	assert mapping == {"encoder.fc1.weight": "enc.0.weight", "encoder.fc1.bias": "enc.0.bias",
+					   "encoder.norm.weight": "enc.1.weight", "encoder.norm.bias": "enc.1.bias",
+					   "encoder.fc2.weight": "enc.2.weight", "encoder.fc2.bias": "enc.2.bias"}
+	converted = enhanced_robust_map(saved, model)
+	model.load_state_dict(converted)
+	assert all(torch.equal(converted[k], saved[v]) for k, v in mapping.items())
+
+def test_similar_names_win_over_position():
+	shapes = {f"blocks.{i}.{p}": (8,) for i in range(3) for p in ("scale", "shift")}
+	saved = {f"model.{k}": shape for k, shape in reversed(list(shapes.items()))}
+	assert _match_keys(saved, shapes, threshold=70, order_window=0) == {k: f"model.{k}" for k in shapes}
+
+class Mixed(nn.Module):
+	""" Parameters and buffers of several dtypes, including bf16 and a 0-d tensor. """
+	def __init__(self):
+		super().__init__()
+		self.fc = nn.Linear(6, 5)
+		self.emb = nn.Embedding(4, 3).to(torch.bfloat16)
+		self.norm = nn.LayerNorm(5).to(torch.float16)
+		self.register_buffer("steps", torch.tensor(7))
+		self.register_buffer("mask", torch.tensor([True, False, True, True, False]))
+
+@pytest.fixture(params=["pt", "safetensors"])
+def saved_checkpoint(request, tmp_path):
+	torch.manual_seed(0)
+	saved = {f"module.{k}": v.clone() for k, v in Mixed().state_dict().items()}
+	path = str(tmp_path / f"saved.{request.param}")
+	if request.param == "pt":
+		torch.save(saved, path)
+	else:
+		_write_safetensors(path, [(k, tuple(v.shape), v.dtype, lambda v=v: v) for k, v in saved.items()])
+	return path, saved
+
+def read_shard(path):
+	""" {key: tensor} of a .safetensors file, parsed straight from the format. """
+	with open(path, "rb") as f:
+		data = f.read()
+	header_size = struct.unpack("<Q", data[:8])[0]
+	assert header_size % 8 == 0
+	header = json.loads(data[8:8 + header_size])
+	body = data[8 + header_size:]
+	end = 0
+	tensors = {}
+	for key, info in header.items():
+		start, stop = info["data_offsets"]
+		assert start == end
+		end = stop
+		tensors[key] = torch.frombuffer(bytearray(body[start:stop]), dtype=_SAFETENSORS_DTYPES[info["dtype"]]).reshape(info["shape"])
+	assert end == len(body)
+	return tensors
+
+def test_stream_convert_round_trip(saved_checkpoint, tmp_path):
+	path, saved = saved_checkpoint
+	model = Mixed()
+	out = str(tmp_path / "out")
+	stream_convert(path, model, out, max_shard_size=64)
+	
+	with open(os.path.join(out, "model.safetensors.index.json")) as f:
+		index = json.load(f)
+	assert set(index["weight_map"]) == set(model.state_dict())
+	assert len(set(index["weight_map"].values())) > 2
+	assert sorted(os.listdir(out)) == sorted(set(index["weight_map"].values()) | {"model.safetensors.index.json"})
+	
+	converted = {}
+	for name in set(index["weight_map"].values()):
+		shard = read_shard(os.path.join(out, name))
+		assert all(index["weight_map"][k] == name for k in shard)
+		converted.update(shard)
+	assert index["metadata"]["total_size"] == sum(t.numel() * t.element_size() for t in converted.values())
+	for key in model.state_dict():
+		expected = saved[f"module.{key}"]
+		assert converted[key].dtype == expected.dtype and torch.equal(converted[key], expected)
+	
+	reread = _TensorReader(out)
+	assert all(torch.equal(reread.tensor(k), converted[k]) for k in converted)
+
+def test_stream_convert_casts_to_model_dtypes(tmp_path):
+	saved = {f"module.{k}": (v.double() if v.is_floating_point() else v) for k, v in Mixed().state_dict().items()}
+	model = Mixed()
+	out = str(tmp_path / "out")
+	stream_convert(saved, model, out, max_shard_size=64, dtype="model")
+	converted = _TensorReader(out)
+	for key, value in model.state_dict().items():
+		tensor = converted.tensor(key)
+		assert tensor.dtype == value.dtype
+		assert torch.equal(tensor, saved[f"module.{key}"].to(value.dtype))
+
+def test_shards_load_with_safetensors(saved_checkpoint, tmp_path):
+	safetensors_torch = pytest.importorskip("safetensors.torch")
+	path, saved = saved_checkpoint
+	out = str(tmp_path / "out")
+	stream_convert(path, Mixed(), out, max_shard_size=64)
+	loaded = {}
+	for name in os.listdir(out):
+		if name.endswith(".safetensors"):
+			loaded.update(safetensors_torch.load_file(os.path.join(out, name)))
+	assert loaded.keys() == Mixed().state_dict().keys()
+	assert all(torch.equal(loaded[k], saved[f"module.{k}"]) for k in loaded)
+
+def test_reads_files_written_by_safetensors(tmp_path):
+	safetensors_torch = pytest.importorskip("safetensors.torch")
+	saved = {f"module.{k}": v for k, v in Mixed().state_dict().items()}
+	path = str(tmp_path / "saved.safetensors")
+	safetensors_torch.save_file(saved, path)
+	reader = _TensorReader(path)
+	assert reader.metadata() == {k: (tuple(v.shape), v.dtype) for k, v in saved.items()}
+	assert all(torch.equal(reader.tensor(k), v) for k, v in saved.items())
@@ -0,0 +1,30 @@
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import pytest
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from sharpen.display_array_as_image import view
+
+def test_view_dataloader_batches():
+	x = torch.rand(10, 3, 8, 8)
+	y = torch.arange(10)
+	canvas = view(DataLoader(TensorDataset(x, y), batch_size=4), max_images=6, grid=True, ncols=3)
+	assert canvas.shape == (2 * 9 + 1, 3 * 9 + 1, 3)
+
+def test_view_image_box_pairs():
+	images = np.zeros((2, 8, 8, 3), dtype=np.uint8)
+	boxes = np.array([[[1, 1, 4, 4]], [[2, 2, 6, 6]]])
+	canvas = view([(images, boxes)], grid=True, ncols=2)
+	assert canvas.any()
+	plain = view([(images, np.arange(2))], grid=True, ncols=2)
+	assert not plain.any()
+
+def test_view_rejects_bad_batches():
+	with pytest.raises(ValueError, match="No images"):
+		view(iter([]), grid=True)
+	with pytest.raises(ValueError, match="2 to 4 dimensions"):
+		view([np.zeros((1, 1, 3, 4, 4))], grid=True)
+	with pytest.raises(TypeError):
+		view([["not", "images"]], grid=True)
@@ -0,0 +1,98 @@
+import os
+import sys
+import heapq
+import contextlib
+import io
+import subprocess
+
+import pytest
+
+from sharpen import dvips_color_matcher
+from sharpen.dvips_color_matcher import (
+	solve, load_data, parse_hex, cmyk_mix, cmyk_to_rgb_naive, rgb_to_lab,
+	distance_rgb_euclidean, delta_e_ciede2000
+)
+
+def scalar_solve(base_colors, target_hex, max_bangs, metric, beam_width, step_size):
+	""" The original pure-Python beam search, kept as the reference. """
+	t_rgb = parse_hex(target_hex)
+	t_lab = rgb_to_lab(t_rgb) if metric == 'lab' else None
+	
+	def get_gap(cand_rgb):
+		if metric == 'lab':
+			return delta_e_ciede2000(rgb_to_lab(cand_rgb), t_lab)
+		return distance_rgb_euclidean(cand_rgb, t_rgb)
+	
+	current_gen = []
+	for name, vec in base_colors.items():
+		c_rgb = cmyk_to_rgb_naive(vec)
+		current_gen.append((get_gap(c_rgb), vec, name, c_rgb))
+	best_results = {0: min(current_gen, key=lambda x: x[0])}
+	
+	for k in range(1, max_bangs + 1):
+		next_gen = []
+		candidates = heapq.nsmallest(beam_width, current_gen, key=lambda x: x[0])
+		for (c_gap, c_vec, c_expr, c_rgb_val) in candidates:
+			partners = [(b_name, b_vec) for b_name, b_vec in base_colors.items() if not c_expr.endswith(b_name)]
+			if k == 1 and "!" not in c_expr:
+				partners.append(("White", base_colors["White"]))
+			for b_name, b_vec in partners:
+				for p in range(step_size, 100, step_size):
+					n_vec = cmyk_mix(c_vec, b_vec, p)
+					n_rgb = cmyk_to_rgb_naive(n_vec)
+					next_gen.append((get_gap(n_rgb), n_vec, f"{c_expr}!{p}!{b_name}", n_rgb))
+		if next_gen:
+			best_results[k] = min(next_gen, key=lambda x: x[0])
+			current_gen = next_gen
+	return t_rgb, best_results
+
+@pytest.fixture(scope="module")
+def base_colors():
+	with contextlib.redirect_stdout(io.StringIO()):
+		return load_data()
+
+@pytest.mark.parametrize("target_hex, max_bangs, metric, beam_width, step_size", [
+	("#474747", 2, "lab", 20, 10),
+	("#FFBE7A", 2, "rgb", 30, 10),
+	("#3450a0", 3, "rgb", 5, 20),
+	("#000000", 2, "rgb", 10, 25),
+	("#FFFFFF", 1, "lab", 100, 10),
+])
+def test_solve_matches_scalar_beam_search(base_colors, target_hex, max_bangs, metric, beam_width, step_size):
+	_, expected = scalar_solve(base_colors, target_hex, max_bangs, metric, beam_width, step_size)
+	_, results = solve(target_hex, max_bangs, metric, beam_width, step_size, palette=base_colors, dedup=False)
+	
+	assert results.keys() == expected.keys()
+	for k in expected:
+		assert results[k][2] == expected[k][2]
+		assert results[k][0] == pytest.approx(expected[k][0], abs=1e-9)
+
+def test_dedup_never_worse(base_colors):
+	_, plain = solve("#12ab34", 2, "rgb", 20, 10, palette=base_colors, dedup=False)
+	_, dedup = solve("#12ab34", 2, "rgb", 20, 10, palette=base_colors)
+	assert all(dedup[k][0] <= plain[k][0] + 1e-9 for k in plain)
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_dedup_keeps_the_beam_full(base_colors, monkeypatch, workers):
+	# Chunks of more mixes than the beam holds, with many equal CMYK vectors among the best of them
+	monkeypatch.setattr(dvips_color_matcher, "EVAL_CHUNK_SIZE", 1 << 17)
+	_, _, stats = solve("#3450a0", 2, "rgb", 300, 10, palette=base_colors, workers=workers, return_stats=True)
+	assert stats.occupancy()[1:] == [1.0, 1.0]
+
+@pytest.mark.parametrize("target_hex, metric", [("#204f89", "rgb"), ("#a30feb", "lab"), ("#FFBE7A", "rgb")])
+def test_refine_matches_fine_grid_at_depth_one(base_colors, target_hex, metric):
+	_, fine = solve(target_hex, 1, metric, 50, 1, palette=base_colors)
+	_, refined = solve(target_hex, 1, metric, 50, 5, palette=base_colors, refine=True)
+	assert refined[1][0] <= fine[1][0] + 1e-9
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_max_evals_is_a_total_budget(base_colors, workers):
+	_, _, stats = solve("#3450a0", 3, "lab", 200, 5, palette=base_colors, max_evals=50000, workers=workers, return_stats=True)
+	# Overrun is at most one parent row (partners x ratios) per worker
+	assert 50000 <= stats.evals <= 50000 + 2 * len(base_colors) * 19
+
+def test_runs_as_a_script(tmp_path):
+	script = os.path.join(os.path.dirname(dvips_color_matcher.__file__), "dvips_color_matcher.py")
+	out = subprocess.run([sys.executable, script, "#3450a0", "-n", "1", "--beam", "50", "--step", "10"], cwd=tmp_path,
+						 capture_output=True, text=True, check=True).stdout
+	assert out.splitlines()[-1].startswith("-") and out.splitlines()[-2].startswith("1 ")
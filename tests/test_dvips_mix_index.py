@@ -0,0 +1,53 @@
+import contextlib
+import io
+import math
+
+import numpy as np
+import pytest
+
+from sharpen.dvips_color_matcher import load_data, solve
+from sharpen import dvips_mix_index
+from sharpen.dvips_mix_index import build_index, MixIndex
+
+STEP = 20
+
+@pytest.fixture(scope="module")
+def palette():
+	with contextlib.redirect_stdout(io.StringIO()):
+		colors = load_data()
+	names = list(colors)[:12] + ["White"]
+	return {name: colors[name] for name in names}
+
+@pytest.fixture(scope="module")
+def index(palette, tmp_path_factory):
+	return build_index(str(tmp_path_factory.mktemp("index") / "mixes.npz"), 2, STEP, palette=palette)
+
+def targets(n=15):
+	rng = np.random.default_rng(0)
+	return ["#000000", "#ffffff", "#0000fe"] + ["#" + "".join(f"{v:02x}" for v in rng.integers(0, 256, 3)) for _ in range(n)]
+
+def exhaustive(target_hex, metric, palette):
+	# A beam wider than the number of mixes keeps every one of them
+	return solve(target_hex, 2, metric, 10**6, STEP, palette=palette, dedup=False)[1]
+
+@pytest.mark.parametrize("metric", ["rgb", "lab"])
+def test_query_matches_exhaustive_search(index, palette, metric):
+	for target_hex in targets():
+		expected = exhaustive(target_hex, metric, palette)
+		_, results = index.query(target_hex, metric)
+		for depth in (0, 1):
+			assert results[depth][0] == pytest.approx(expected[depth][0], abs=1e-9), (target_hex, depth)
+		# Depth 2 keeps one mix per 24-bit RGB value, at most a cell diagonal from the best one
+		assert results[2][0] >= expected[2][0] - 1e-9
+		if metric == "rgb":
+			assert results[2][0] <= expected[2][0] + math.sqrt(3) + 1e-6, target_hex
+
+def test_load_round_trip(index, tmp_path, monkeypatch):
+	path = str(tmp_path / "small.npz")
+	build_index(path, 1, STEP, palette={name: cmyk for name, cmyk in zip(index.names, index.cmyk)})
+	monkeypatch.setattr(dvips_mix_index, "_INDEX_MEMO", {})
+	reopened = MixIndex.load(path)
+	assert reopened.max_bangs == 1 and reopened.names == index.names
+	assert reopened.query("#3450a0")[1] == index.query("#3450a0", max_bangs=1)[1]
+	with pytest.raises(ValueError):
+		reopened.query("#3450a0", max_bangs=2)
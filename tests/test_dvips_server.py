@@ -0,0 +1,65 @@
+import io
+import json
+
+import pytest
+
+from sharpen.dvips_server import DvipsService, serve_stdio
+
+@pytest.fixture
+def service():
+	return DvipsService(defaults={"bangs": 1, "beam": 50, "step": 10})
+
+def test_handle_line(service):
+	response = json.loads(service.handle_line('{"id": 7, "hex": "#3450a0", "metric": "lab"}'))
+	assert response["id"] == 7 and response["hex"] == "#3450a0" and "error" not in response
+	assert [r["depth"] for r in response["results"]] == [0, 1]
+	assert response["results"][1]["gap"] <= response["results"][0]["gap"]
+	assert service.handle_line("  \n") is None
+
+def test_handle_line_reports_errors(service):
+	response = json.loads(service.handle_line('{"id": "a", "hex": "#zzzzzz"}'))
+	assert response["id"] == "a" and response["error"].startswith("ValueError")
+	response = json.loads(service.handle_line('{"id": "b", "hex": "#3450a0", "metric": "hsv"}'))
+	assert response["id"] == "b" and "Unknown metric" in response["error"]
+	response = json.loads(service.handle_line('{"id": 1, "hex": '))
+	assert response["id"] is None and response["error"].startswith("Invalid JSON")
+	response = json.loads(service.handle_line('["#3450a0"]'))
+	assert "'hex' field" in response["error"]
+
+def test_result_cache(service):
+	first = service.handle({"hex": "#3450a0"})
+	assert (service.hits, service.misses) == (0, 1)
+	assert service.handle({"hex": "#3450A0"})["results"] == first["results"]
+	assert (service.hits, service.misses) == (1, 1)
+	service.handle({"hex": "#3450a0", "beam": 20})
+	assert (service.hits, service.misses) == (1, 2)
+	
+	# Budgeted searches depend on timing: neither served from nor stored in the cache
+	cached = len(service._results)
+	for _ in range(2):
+		service.handle({"hex": "#3450a0", "time_budget": 10})
+	assert (service.hits, service.misses) == (1, 4)
+	assert len(service._results) == cached
+
+def test_cache_evicts_least_recently_used():
+	service = DvipsService(cache_size=2, defaults={"bangs": 1, "beam": 20, "step": 25})
+	for h in ("#000000", "#ffffff", "#000000", "#ff0000", "#000000", "#ffffff"):
+		service.handle({"hex": h})
+	# #ffffff was evicted by #ff0000, #000000 was kept by its hits
+	assert (service.hits, service.misses) == (2, 4)
+
+def test_serve_stdio_round_trip(service):
+	requests = [{"id": i, "hex": h} for i, h in enumerate(["#3450a0", "#ffbe7a", "#000000", "#zzzzzz", "#3450a0"])]
+	stdin = io.StringIO("\n".join(json.dumps(r) for r in requests) + "\n\n")
+	stdout = io.StringIO()
+	serve_stdio(service, workers=3, stdin=stdin, stdout=stdout)
+	
+	responses = {r["id"]: r for r in map(json.loads, stdout.getvalue().splitlines())}
+	assert sorted(responses) == [r["id"] for r in requests]
+	for request in requests:
+		response = responses[request["id"]]
+		if request["hex"] == "#zzzzzz":
+			assert "error" in response
+		else:
+			assert response["hex"] == request["hex"]
+			assert response == json.loads(service.handle_line(json.dumps(request)))
@@ -0,0 +1,47 @@
+import os
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import cv2
+import numpy as np
+import pytest
+
+from sharpen.load_image_array_from_url import imgs_from_urls, _url_cache_path
+
+IMAGE = np.random.default_rng(0).integers(0, 256, (8, 6, 3), dtype=np.uint8)
+
+class Handler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+	bodies = {"/image.png": cv2.imencode(".png", IMAGE[:, :, ::-1])[1].tobytes(),
+			  "/error.png": b"<html>Service unavailable</html>"}
+	
+	def do_GET(self):
+		body = self.bodies[self.path]
+		self.send_response(200)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+	
+	def log_message(self, *args):
+		pass
+
+@pytest.fixture
+def server():
+	httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+	thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+	thread.start()
+	yield f"http://127.0.0.1:{httpd.server_port}"
+	httpd.shutdown()
+	httpd.server_close()
+
+def test_images_are_decoded_and_cached(server, tmp_path):
+	url = f"{server}/image.png"
+	images = list(imgs_from_urls([url, url], num_workers=2, cache_dir=tmp_path))
+	assert all(np.array_equal(image, IMAGE) for image in images)
+	assert os.path.exists(_url_cache_path(url, tmp_path))
+
+def test_undecodable_body_is_not_cached(server, tmp_path):
+	url = f"{server}/error.png"
+	with pytest.raises(ValueError):
+		list(imgs_from_urls([url], cache_dir=tmp_path))
+	assert not os.path.exists(_url_cache_path(url, tmp_path))
+	assert list(imgs_from_urls([url], cache_dir=tmp_path, errors="skip")) == [None]
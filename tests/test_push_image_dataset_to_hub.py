@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from datasets import load_dataset
+from sharpen import push_image_dataset_to_hub
+from sharpen.push_image_dataset_to_hub import push_images, load_labels, iter_labels
+
+@pytest.fixture
+def image_folder(tmp_path):
+	folder = tmp_path / "images"
+	folder.mkdir()
+	rng = np.random.default_rng(0)
+	for i in range(7):
+		Image.fromarray(rng.integers(0, 256, (8, 6, 3), dtype=np.uint8)).save(folder / f"img{i}.png")
+	return str(folder)
+
+def push(image_folder, local_dir, **options):
+	return push_images(image_folder, None, None, "default", list(range(7)), class_names=[f"c{i}" for i in range(7)],
+					   shard_size=3, local_dir=local_dir, **options)
+
+def read_back(local_dir):
+	# datasets caches prepared local datasets by folder name, so always rebuild
+	return load_dataset(local_dir, "default", split="train", download_mode="force_redownload")
+
+def test_local_dir_round_trip(image_folder, tmp_path):
+	out = str(tmp_path / "out")
+	push(image_folder, out)
+	ds = read_back(out)
+	
+	assert ds.features["label"].names == [f"c{i}" for i in range(7)]
+	assert ds["label"] == list(range(7))
+	expected = np.asarray(Image.open(os.path.join(image_folder, "img4.png")).convert("RGB"))
+	assert np.array_equal(np.asarray(ds[4]["image"]), expected)
+
+def test_rerun_with_new_read_options_rewrites_shards(image_folder, tmp_path, capsys):
+	out = str(tmp_path / "out")
+	push(image_folder, out)
+	capsys.readouterr()
+	
+	push(image_folder, out)
+	assert "Wrote shard" not in capsys.readouterr().out
+	
+	push(image_folder, out, image_mode="L")
+	assert capsys.readouterr().out.count("Wrote shard") == 3
+	assert read_back(out)[0]["image"].mode == "L"
+
+def test_workers_persist_across_shards(image_folder, tmp_path, capsys, monkeypatch):
+	pools = []
+	class CountingPool(push_image_dataset_to_hub.ThreadPoolExecutor):
+		def __init__(self, *args, **kwargs):
+			pools.append(self)
+			super().__init__(*args, **kwargs)
+	monkeypatch.setattr(push_image_dataset_to_hub, "ThreadPoolExecutor", CountingPool)
+	
+	out = str(tmp_path / "out")
+	push(image_folder, out, num_workers=2)
+	assert len(pools) == 1
+	assert capsys.readouterr().out.count("Wrote shard") == 3
+	
+	# Only the middle shard changed: the others are skipped while its images are read
+	Image.fromarray(np.zeros((8, 6, 3), dtype=np.uint8)).save(os.path.join(image_folder, "img4.png"))
+	push(image_folder, out, num_workers=2)
+	printed = capsys.readouterr().out
+	assert printed.count("Wrote shard") == 1 and "Wrote shard 1 " in printed
+	ds = read_back(out)
+	assert ds["label"] == list(range(7))
+	for i in range(7):
+		expected = np.asarray(Image.open(os.path.join(image_folder, f"img{i}.png")).convert("RGB"))
+		assert np.array_equal(np.asarray(ds[i]["image"]), expected)
+
+def test_txt_labels_parse_the_same_loaded_or_streamed(tmp_path):
+	path = tmp_path / "labels.txt"
+	path.write_text("3\n 1 \n\n4\n")
+	assert load_labels(str(path)).tolist() == list(iter_labels(str(path))) == [3, 1, 4]